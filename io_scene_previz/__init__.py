@@ -26,9 +26,12 @@ site.addsitedir(sitedir())
 
 import pyperclip
 
-import previz
+from . import cache
+from . import client
+from . import delta
 from . import tasks
 from . import three_js_exporter
+from . import upload
 from . import utils
 
 
@@ -46,6 +49,27 @@ bl_info = {
 version_string = '.'.join([str(x) for x in bl_info['version']])
 
 TEMPORARY_DIRECTORY_PREFIX = 'blender-{}-'.format(__name__)
+GEOMETRY_CACHE_DIRNAME = __name__ + '-geometry-cache'
+MANIFESTS_DIRNAME = __name__ + '-manifests'
+UPLOADS_DIRNAME = __name__ + '-uploads'
+TREE_CACHE_DIRNAME = __name__ + '-tree-cache'
+DEFAULT_GEOMETRY_CACHE_SIZE = 1024 # MB
+
+GEOMETRY_FORMAT_JSON = (
+    'JSON',
+    'JSON',
+    'three.js JSON geometries, with faces, vertices and UVs as JSON arrays'
+)
+GEOMETRY_FORMAT_BUFFER_BIN = (
+    'BUFFER_BIN',
+    'Binary sidecar',
+    'three.js BufferGeometry, with buffers in a .bin file next to the .json file'
+)
+GEOMETRY_FORMAT_BUFFER_BASE64 = (
+    'BUFFER_BASE64',
+    'Binary embedded',
+    'three.js BufferGeometry, with buffers embedded in the .json file as base64'
+)
 
 
 #############################################################################
@@ -54,7 +78,10 @@ TEMPORARY_DIRECTORY_PREFIX = 'blender-{}-'.format(__name__)
 
 
 active = utils.Active()
+change_tracker = three_js_exporter.ChangeTracker()
+geometry_pool = None
 new_plugin_version = None
+resumable_publishes = {}
 tasks_runner = None
 
 
@@ -67,57 +94,42 @@ class ManageQueue(bpy.types.Operator):
     bl_idname = 'export_scene.previz_manage_queue'
     bl_label = 'Manage Previz task queue'
 
-    process_polling_interval = .25 # Needs to be a debug User Preferences flag
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        self.timer = None
-
     def execute(self, context):
         if tasks_runner.is_empty:
-            self.cleanup(context)
             return {'FINISHED'}
 
+        # Timers do not run in background mode
         if bpy.app.background:
             tasks_runner.tick(context)
             return {'CANCELLED'}
 
-        self.register_timer(context)
-        context.window_manager.modal_handler_add(self)
-        return {'RUNNING_MODAL'}
+        start_queue_timer()
+        return {'FINISHED'}
 
-    def cancel(self, context):
-        self.cleanup(context)
 
-    def modal(self, context, event):
-        if event.type == 'ESC':
-            return {'CANCELED'}
+def poll_tasks():
+    interval = tasks_runner.poll(bpy.context)
+    if interval is None:
+        report = client.clients.new_report()
+        if report is not None:
+            print(report)
+    return interval
 
-        if event.type == 'TIMER':
-            return self.handle_timer_event(context, event)
 
-        return {'PASS_THROUGH'}
+def start_queue_timer():
+    """Poll the tasks as soon as possible, see tasks.TasksRunner.poll"""
+    # Tasks added while polling are picked up by the current timer
+    if tasks_runner.is_ticking:
+        return
+    stop_queue_timer()
+    bpy.app.timers.register(poll_tasks,
+                            first_interval=tasks_runner.min_poll_interval,
+                            persistent=True)
 
-    def handle_timer_event(self, context, event):
-        if tasks_runner.is_empty:
-            self.cleanup(context)
-            return {'FINISHED'}
-        tasks_runner.tick(context)
-        return {'RUNNING_MODAL'}
 
-    def cleanup(self, context):
-        tasks_runner.cancel()
-        self.unregister_timer(context)
-
-    def register_timer(self, context):
-        if self.timer is None:
-            self.timer = context.window_manager.event_timer_add(self.process_polling_interval, window=context.window)
-
-    def unregister_timer(self, context):
-        if self.timer is not None:
-            context.window_manager.event_timer_remove(self.timer)
-            self.timer = None
+def stop_queue_timer():
+    if bpy.app.timers.is_registered(poll_tasks):
+        bpy.app.timers.unregister(poll_tasks)
 
 
 class CancelTask(bpy.types.Operator):
@@ -130,7 +142,7 @@ class CancelTask(bpy.types.Operator):
     )
 
     def execute(self, context):
-        tasks_runner.tasks[self.task_id].cancel()
+        tasks_runner.cancel_task(tasks_runner.tasks[self.task_id])
         return {'FINISHED'}
 
 
@@ -213,13 +225,124 @@ Please paste it to Previz support.
 # PREVIZ OPERATORS
 #############################################################################
 
-def mkstemp(context, *args, **kwargs):
-    return tempfile.mkstemp(
-        prefix = __name__ + '-',
-        dir = context.preferences.filepaths.temporary_directory,
-        *args,
-        **kwargs
+def temporary_directory(context):
+    directory = context.preferences.filepaths.temporary_directory
+    if len(directory) == 0:
+        directory = tempfile.gettempdir()
+    return pathlib.Path(directory)
+
+
+def upload_store(context):
+    return upload.UploadStore(temporary_directory(context) / UPLOADS_DIRNAME)
+
+
+def can_resume_publish(context, api_root, scene_id):
+    """
+    Can the interrupted publish of scene_id be resumed? Read from the upload
+    store once, until a publish of the scene finishes.
+    """
+    key = (api_root, scene_id)
+    if key not in resumable_publishes:
+        resumable_publishes[key] = upload_store(context).can_resume(api_root, scene_id)
+    return resumable_publishes[key]
+
+
+def publish_finished(api_root, scene_id):
+    def on_finished(context):
+        resumable_publishes.pop((api_root, scene_id), None)
+    return on_finished
+
+
+def tree_cache(context, api_root, api_token):
+    return cache.TreeCache(temporary_directory(context) / TREE_CACHE_DIRNAME, api_root, api_token)
+
+
+def update_teams(context, trees, teams):
+    active.update_teams(teams, trees.put_teams(teams))
+    active.ensure_loaded(context)
+
+
+def load_children(context, item, name):
+    """Load the projects of a team or the scenes of a project, see utils.Active"""
+    for task in tasks_runner.tasks.values():
+        if isinstance(task, tasks.GetChildrenTask) and not task.is_finished \
+           and (task.name, task.item_id) == (name, item['id']):
+            return
+
+    extract = utils.extract_projects if name == 'projects' else utils.extract_scenes
+
+    def on_done(context, data):
+        active.set_children(context, name, item['id'], extract(data))
+
+    api_root, api_token = previz_preferences(context)
+    task = tasks.GetChildrenTask(api_root, api_token, name, item['id'], on_done)
+    tasks_runner.add_task(context, task)
+
+
+def build_geometry_cache(context):
+    prefs = context.preferences.addons[__name__].preferences
+    max_size = getattr(prefs, 'geometry_cache_size', DEFAULT_GEOMETRY_CACHE_SIZE)
+    return cache.GeometryCache(
+        temporary_directory(context) / GEOMETRY_CACHE_DIRNAME,
+        max_size * 1024 * 1024
+    )
+
+
+def get_geometry_pool(context):
+    """
+    Return the GeometryPool for the export_workers preference, None to
+    build the geometries in Blender. The pool is kept between exports.
+    """
+    global geometry_pool
+
+    prefs = context.preferences.addons[__name__].preferences
+    workers = getattr(prefs, 'export_workers', 1)
+
+    if geometry_pool is not None and geometry_pool.workers != workers:
+        shutdown_geometry_pool()
+    if geometry_pool is None and workers > 1:
+        geometry_pool = three_js_exporter.GeometryPool(workers)
+    return geometry_pool
+
+
+def begin_export(context,
+                 geometry_format,
+                 share_identical_geometries,
+                 use_geometry_cache,
+                 precision,
+                 weld_uvs,
+                 deferred=False):
+    """
+    Start an export with change_tracker.
+
+    Returns the Geometries to export and the geometry cache, None when not
+    used. With deferred, the JSON geometries are built when exported, for
+    three_js_exporter.snapshot_scene.
+    """
+    # Buffer geometries are written straight from the mesh buffers
+    buffer_geometry = geometry_format != 'JSON'
+    use_geometry_cache = use_geometry_cache and not buffer_geometry
+
+    geometry_cache = build_geometry_cache(context) if use_geometry_cache else None
+    pool = get_geometry_pool(context)
+    if deferred:
+        pool = three_js_exporter.DeferredPool(pool)
+    geometries = change_tracker.begin(
+        share_identical_geometries,
+        geometry_cache,
+        buffer_geometry,
+        precision,
+        weld_uvs,
+        pool
     )
+    return geometries, geometry_cache
+
+
+def shutdown_geometry_pool():
+    global geometry_pool
+    if geometry_pool is not None:
+        geometry_pool.shutdown()
+        geometry_pool = None
 
 
 class ApiOperatorMixin:
@@ -245,6 +368,45 @@ class ObjectModeMixin:
         return context.mode == 'OBJECT'
 
 
+class PrecisionMixin:
+    precision_mode : EnumProperty(
+        name='Precision',
+        description='Precision of the exported vertices and UVs',
+        items=[
+            ('FULL', 'Full', 'Keep the full precision'),
+            (three_js_exporter.PRECISION_ROUND, 'Round', 'Round to a number of decimals'),
+            (three_js_exporter.PRECISION_QUANTIZE, 'Quantize', 'Snap to a grid over the bounding box')
+        ],
+        default='FULL'
+    )
+
+    precision_decimals : IntProperty(
+        name='Decimals',
+        description='Number of decimals kept when rounding',
+        default=5,
+        min=0,
+        max=15
+    )
+
+    quantization_bits : IntProperty(
+        name='Quantization bits',
+        description='Number of bits per component when quantizing',
+        default=16,
+        min=1,
+        max=32
+    )
+
+    precision_properties = ('precision_mode', 'precision_decimals', 'quantization_bits')
+
+    @property
+    def precision(self):
+        if self.precision_mode == three_js_exporter.PRECISION_ROUND:
+            return three_js_exporter.Precision(self.precision_mode, self.precision_decimals)
+        if self.precision_mode == three_js_exporter.PRECISION_QUANTIZE:
+            return three_js_exporter.Precision(self.precision_mode, self.quantization_bits)
+        return None
+
+
 class PublishScene(bpy.types.Operator, ApiOperatorMixin, ObjectModeMixin):
     bl_idname = 'export_scene.previz_publish_scene'
     bl_label = 'Export scene to Previz'
@@ -268,34 +430,134 @@ class PublishScene(bpy.types.Operator, ApiOperatorMixin, ObjectModeMixin):
         options={'HIDDEN'}
     )
 
+    delta_publish : BoolProperty(
+        name='Delta publish',
+        description='Only upload the objects and geometries changed since the last publish',
+        default=False
+    )
+
+    # The scene is uploaded as a single file: no sidecar
+    geometry_format : EnumProperty(
+        name='Geometry format',
+        items=[GEOMETRY_FORMAT_JSON, GEOMETRY_FORMAT_BUFFER_BASE64],
+        default='JSON'
+    )
+
+    read_in_slices : BoolProperty(
+        name='Read scene in slices',
+        description='Read the scene in short time slices, so Blender stays responsive on large scenes',
+        default=True
+    )
+
+    resumable_upload : BoolProperty(
+        name='Resumable upload',
+        description='Upload the scene in chunks, so an interrupted upload can be resumed',
+        default=True
+    )
+
     def execute(self, context):
         # Keep a reference to debug_cleanup so the call back
         # still sees it after the Operator is destroyed
         debug_cleanup = self.debug_cleanup
         def on_done(*args, **kwargs):
-            if debug_cleanup and export_path.exists():
+            if geometry_cache is not None:
+                geometry_cache.trim()
+                print(geometry_cache.report())
+
+            if export_path is not None and debug_cleanup and export_path.exists():
                 try:
                     export_path.unlink()
                 except PermissionError:
                     mask = 'Not removing scene used by another process: {}'
                     print(mask.format(export_path))
 
-        export_path = pathlib.Path(self.debug_export_path)
-
-        ret = bpy.ops.export_scene.previz_export_scene(
-            filepath=str(export_path)
+        # The scene is uploaded while it is exported, the export path only
+        # gets a copy for debugging
+        export_path = None
+        if len(self.debug_export_path) > 0:
+            export_path = pathlib.Path(self.debug_export_path)
+
+        # Full publishes remove the manifest of the scene, so the next delta
+        # publish does not patch a scene the server no longer has
+        manifests = delta.ManifestStore(temporary_directory(context) / MANIFESTS_DIRNAME)
+
+        buffer_writer = None
+        if self.geometry_format == 'BUFFER_BASE64':
+            buffer_writer = three_js_exporter.embedded_buffer_writer
+
+        publish_task_kwargs = {
+            'api_root': self.api_root,
+            'api_token': self.api_token,
+            'project_id': self.project_id,
+            'scene_id': self.scene_id,
+            'export_path': export_path,
+            'manifests': manifests,
+            'delta_publish': self.delta_publish,
+            'uploads': upload_store(context) if self.resumable_upload else None,
+            'buffer_writer': buffer_writer
+        }
+        def on_read(context, scene):
+            change_tracker.exported(geometries)
+
+            task = tasks.PublishSceneTask(
+                scene = scene,
+                geometries = geometries,
+                on_done = on_done,
+                on_finished = publish_finished(publish_task_kwargs['api_root'],
+                                               publish_task_kwargs['scene_id']),
+                **publish_task_kwargs
+            )
+            tasks_runner.add_task(context, task)
+
+        # Only read the scene here, the publish task builds and writes it
+        # while Blender stays responsive
+        prefs = context.preferences.addons[__name__].preferences
+        geometries, geometry_cache = begin_export(
+            context,
+            self.geometry_format,
+            share_identical_geometries=False,
+            use_geometry_cache=True,
+            precision=getattr(prefs, 'precision', None),
+            weld_uvs=True,
+            deferred=True
         )
-        if 'FINISHED' not in ret:
-            on_done()
-            return ret
+        if self.read_in_slices:
+            task = tasks.SnapshotSceneTask(geometries, change_tracker, on_read)
+            tasks_runner.add_task(context, task)
+        else:
+            on_read(context, three_js_exporter.snapshot_scene(context, geometries, change_tracker))
+
+        return {'FINISHED'}
 
+    def invoke(self, context, event):
+        ApiOperatorMixin.invoke(self, context, event)
+        self.project_id = active.project(context)['id']
+        self.scene_id = active.scene(context)['id']
+        return self.execute(context)
+
+
+class ResumePublishScene(bpy.types.Operator, ApiOperatorMixin):
+    bl_idname = 'export_scene.previz_resume_publish_scene'
+    bl_label = 'Resume the interrupted Previz publish'
+
+    project_id : StringProperty(
+        name='Previz project ID'
+    )
+
+    scene_id : StringProperty(
+        name='Previz scene ID',
+    )
+
+    def execute(self, context):
         task = tasks.PublishSceneTask(
             api_root = self.api_root,
             api_token = self.api_token,
             project_id = self.project_id,
             scene_id = self.scene_id,
-            export_path = export_path,
-            on_done = on_done
+            manifests = delta.ManifestStore(temporary_directory(context) / MANIFESTS_DIRNAME),
+            uploads = upload_store(context),
+            resume = True,
+            on_finished = publish_finished(self.api_root, self.scene_id)
         )
         tasks_runner.add_task(context, task)
 
@@ -305,11 +567,10 @@ class PublishScene(bpy.types.Operator, ApiOperatorMixin, ObjectModeMixin):
         ApiOperatorMixin.invoke(self, context, event)
         self.project_id = active.project(context)['id']
         self.scene_id = active.scene(context)['id']
-        self.debug_export_path = mkstemp(context, suffix='.json')[1]
         return self.execute(context)
 
 
-class ExportScene(bpy.types.Operator, ExportHelper, ObjectModeMixin):
+class ExportScene(bpy.types.Operator, ExportHelper, ObjectModeMixin, PrecisionMixin):
     '''Export scene to a Previz (.json) format file'''
     bl_idname = 'export_scene.previz_export_scene'
     bl_label = 'Export scene to a Previz file'
@@ -325,31 +586,103 @@ class ExportScene(bpy.types.Operator, ExportHelper, ObjectModeMixin):
 
     check_extension = True
 
+    share_identical_geometries : BoolProperty(
+        name='Share identical geometries',
+        description='Export meshes with identical geometry data only once',
+        default=False
+    )
+
+    use_geometry_cache : BoolProperty(
+        name='Use geometry cache',
+        description='Reuse the geometries of unchanged meshes from previous exports',
+        default=True
+    )
+
+    weld_uvs : BoolProperty(
+        name='Weld UVs',
+        description='Export identical UV coordinates only once per UV set',
+        default=True
+    )
+
+    geometry_format : EnumProperty(
+        name='Geometry format',
+        items=[GEOMETRY_FORMAT_JSON,
+               GEOMETRY_FORMAT_BUFFER_BIN,
+               GEOMETRY_FORMAT_BUFFER_BASE64],
+        default='JSON'
+    )
+
     def execute(self, context):
         filepath = pathlib.Path(self.as_keywords()['filepath'])
+
+        geometries, geometry_cache = begin_export(
+            context,
+            self.geometry_format,
+            self.share_identical_geometries,
+            self.use_geometry_cache,
+            self.precision,
+            self.weld_uvs
+        )
+
+        scene = three_js_exporter.build_scene(context, geometries, change_tracker)
         with filepath.open('w') as fp:
-            previz.export(three_js_exporter.build_scene(context), fp)
+            if self.geometry_format == 'BUFFER_BIN':
+                sidecar_path = filepath.with_suffix('.bin')
+                with sidecar_path.open('wb') as sidecar_fp:
+                    buffer_writer = three_js_exporter.SidecarBufferWriter(
+                        sidecar_fp,
+                        sidecar_path.name
+                    )
+                    three_js_exporter.export(scene, fp, buffer_writer)
+            elif self.geometry_format == 'BUFFER_BASE64':
+                three_js_exporter.export(scene, fp, three_js_exporter.embedded_buffer_writer)
+            else:
+                three_js_exporter.export(scene, fp)
+        change_tracker.exported(geometries)
+
+        if geometry_cache is not None:
+            geometry_cache.trim()
+            report = geometry_cache.report()
+            print(report)
+            self.report({'INFO'}, report)
+
         return {'FINISHED'}
 
+    def invoke(self, context, event):
+        for name, value in precision_preferences(context).items():
+            setattr(self, name, value)
+        return ExportHelper.invoke(self, context, event)
+
 
 class RefreshProjects(bpy.types.Operator, ApiOperatorMixin):
     bl_idname = 'export_scene.previz_refresh'
     bl_label = 'Refresh Previz'
 
     def execute(self, context):
+        global new_plugin_version
+
+        trees = tree_cache(context, self.api_root, self.api_token)
+        lazy = lazy_tree_preference(context)
+        active.load_children = load_children if lazy else None
+
         def on_get_all(context, data):
-            active.teams = utils.extract_all(data)
+            teams = utils.extract_teams(data) if lazy else utils.extract_all(data)
+            update_teams(context, trees, teams)
 
         def on_updated_plugins(context, data):
             global new_plugin_version
             new_plugin_version = data
+            trees.put_updated_plugin(data)
+
+        is_plugin_check_fresh, new_plugin_version = trees.updated_plugin()
 
         task = tasks.RefreshAllTask(
             self.api_root,
             self.api_token,
             version_string,
             on_get_all,
-            on_updated_plugins
+            None if is_plugin_check_fresh else on_updated_plugins,
+            lazy
         )
         tasks_runner.add_task(context, task)
         return {'FINISHED'}
@@ -373,8 +706,10 @@ class CreateProject(bpy.types.Operator, ApiOperatorMixin):
     )
 
     def execute(self, context):
+        trees = tree_cache(context, self.api_root, self.api_token)
+
         def on_done(context, data, project):
-            active.teams = utils.extract_all(data)
+            update_teams(context, trees, utils.extract_all(data))
             active.set_project(context, project)
 
         task = tasks.CreateProjectTask(
@@ -408,8 +743,10 @@ class CreateScene(bpy.types.Operator, ApiOperatorMixin):
     )
 
     def execute(self, context):
+        trees = tree_cache(context, self.api_root, self.api_token)
+
         def on_done(context, data, scene):
-            active.teams = utils.extract_all(data)
+            update_teams(context, trees, utils.extract_all(data))
             active.set_scene(context, scene)
 
         task = tasks.CreateSceneTask(
@@ -434,7 +771,7 @@ class CreateScene(bpy.types.Operator, ApiOperatorMixin):
 #############################################################################
 
 
-class PrevizPreferences(bpy.types.AddonPreferences):
+class PrevizPreferences(bpy.types.AddonPreferences, PrecisionMixin):
     bl_idname = __name__
 
     api_root : StringProperty(
@@ -447,6 +784,26 @@ class PrevizPreferences(bpy.types.AddonPreferences):
         subtype='PASSWORD'
     )
 
+    geometry_cache_size : IntProperty(
+        name='Geometry cache size (MB)',
+        default=DEFAULT_GEOMETRY_CACHE_SIZE,
+        min=0
+    )
+
+    export_workers : IntProperty(
+        name='Export worker processes',
+        description='Processes building the JSON geometries, 1 to build them in Blender',
+        default=1,
+        min=1,
+        soft_max=os.cpu_count() or 1
+    )
+
+    lazy_tree : BoolProperty(
+        name='Load projects and scenes on demand',
+        description='Only get the teams on refresh, for accounts with many projects',
+        default=False
+    )
+
     def draw(self, context):
         layout = self.layout
 
@@ -461,12 +818,34 @@ class PrevizPreferences(bpy.types.AddonPreferences):
         # Should be dynamic, depending on api_root
         op.url = 'https://app.previz.co/account/api'
 
+        layout.prop(self, 'geometry_cache_size')
+        layout.prop(self, 'export_workers')
+        layout.prop(self, 'lazy_tree')
+
+        layout.prop(self, 'precision_mode')
+        if self.precision_mode == three_js_exporter.PRECISION_ROUND:
+            layout.prop(self, 'precision_decimals')
+        if self.precision_mode == three_js_exporter.PRECISION_QUANTIZE:
+            layout.prop(self, 'quantization_bits')
+
 
 def previz_preferences(context):
     prefs = context.preferences.addons[__name__].preferences
     return prefs.api_root, prefs.api_token
 
 
+def lazy_tree_preference(context):
+    prefs = context.preferences.addons[__name__].preferences
+    return getattr(prefs, 'lazy_tree', False)
+
+
+def precision_preferences(context):
+    prefs = context.preferences.addons[__name__].preferences
+    return dict((name, getattr(prefs, name))
+                for name in PrecisionMixin.precision_properties
+                if hasattr(prefs, name))
+
+
 #############################################################################
 # PANELS
 #############################################################################
@@ -541,6 +920,15 @@ class PrevizPanel(bpy.types.Panel):
             )
             row.enabled = not is_working and is_scene_valid
 
+            if is_scene_valid and can_resume_publish(context, api_root, active.scene(context)['id']):
+                row = self.layout.row()
+                row.operator(
+                    operator='export_scene.previz_resume_publish_scene',
+                    text='Resume interrupted publish',
+                    icon='RECOVER_LAST'
+                )
+                row.enabled = not is_working
+
 
         row = self.layout.row()
         row.operator(
@@ -596,7 +984,11 @@ def register_tasks_runner():
     tasks_runner = tasks.TasksRunner()
 
     def refresh_panel(*args, **kwarsg):
-        bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1)
+        # Only the areas that can show PrevizPanel
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == PrevizPanel.bl_space_type:
+                    area.tag_redraw()
     if not bpy.app.background:
         tasks_runner.on_task_changed.append(refresh_panel)
 
@@ -604,11 +996,87 @@ def register_tasks_runner():
         bpy.ops.export_scene.previz_manage_queue()
     tasks_runner.on_queue_started.append(manage_queue)
 
+    def wake_queue(*args, **kwargs):
+        start_queue_timer()
+    if not bpy.app.background:
+        tasks_runner.on_task_added.append(wake_queue)
+
 
 def unregister_tasks_runner():
     global tasks_runner
+    stop_queue_timer()
     tasks_runner.cancel()
     tasks_runner = None
+    client.loop_thread.stop()
+    client.clients.close()
+
+
+def load_tree_cache():
+    """
+    Show the cached teams/projects/scenes tree and refresh it in the
+    background. Run by a timer, as the context is restricted in register().
+    """
+    if not (PrevizPreferences.is_registered and RefreshProjects.is_registered):
+        return None
+
+    context = bpy.context
+    api_root, api_token = previz_preferences(context)
+    if len(api_root) == 0 or len(api_token) == 0:
+        return None
+
+    teams, teams_hash = tree_cache(context, api_root, api_token).teams()
+    if teams is not None:
+        active.update_teams(teams, teams_hash)
+
+    bpy.ops.export_scene.previz_refresh(api_root=api_root, api_token=api_token)
+    return None
+
+
+def register_tree_cache():
+    bpy.app.timers.register(load_tree_cache, first_interval=0, persistent=True)
+
+
+def unregister_tree_cache():
+    if bpy.app.timers.is_registered(load_tree_cache):
+        bpy.app.timers.unregister(load_tree_cache)
+
+
+@bpy.app.handlers.persistent
+def on_depsgraph_update_post(scene, depsgraph=None):
+    # Blender 2.80 handlers only get the scene
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+    change_tracker.on_depsgraph_update(scene, depsgraph)
+
+
+@bpy.app.handlers.persistent
+def on_frame_change_post(scene, depsgraph=None):
+    change_tracker.on_frame_change(scene, depsgraph)
+
+
+@bpy.app.handlers.persistent
+def on_data_reloaded(*args, **kwargs):
+    # Loading a file or undoing reallocates the datablocks
+    change_tracker.clear()
+
+
+def register_change_tracker():
+    bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update_post)
+    bpy.app.handlers.frame_change_post.append(on_frame_change_post)
+    for handlers in (bpy.app.handlers.load_post,
+                     bpy.app.handlers.undo_post,
+                     bpy.app.handlers.redo_post):
+        handlers.append(on_data_reloaded)
+
+
+def unregister_change_tracker():
+    bpy.app.handlers.depsgraph_update_post.remove(on_depsgraph_update_post)
+    bpy.app.handlers.frame_change_post.remove(on_frame_change_post)
+    for handlers in (bpy.app.handlers.load_post,
+                     bpy.app.handlers.undo_post,
+                     bpy.app.handlers.redo_post):
+        handlers.remove(on_data_reloaded)
+    change_tracker.clear()
 
 
 def menu_export(self, context):
@@ -626,6 +1094,7 @@ classes = (
     
     # RefreshProjects,
     # PublishScene,
+    # ResumePublishScene,
     # CreateProject,
     # CreateScene,
 
@@ -637,16 +1106,23 @@ classes = (
 
 def register():
     register_tasks_runner()
+    register_change_tracker()
 
     for cls in classes:
         bpy.utils.register_class(cls)
 
+    register_tree_cache()
+
     bpy.types.TOPBAR_MT_file_export.append(menu_export)
 
 def unregister():
+    unregister_tree_cache()
+
     for cls in classes:
         bpy.utils.unregister_class(cls)
 
     bpy.types.TOPBAR_MT_file_export.remove(menu_export)
 
+    unregister_change_tracker()
     unregister_tasks_runner()
+    shutdown_geometry_pool()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import time
+
+
+PLUGIN_CHECK_TTL = 24 * 60 * 60 # s
+
+
+def write_json(path, data):
+    path = pathlib.Path(path)
+    # Each writer gets its own temporary file, as geometry worker processes
+    # may write the same entry at the same time
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(data, fp)
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_entry(path, faces, vertices, uvsets, build_time):
+    entry = {
+        'build_time': build_time,
+        'faces': faces,
+        'vertices': vertices,
+        'uvsets': uvsets
+    }
+    write_json(path, entry)
+
+
+class GeometryCache(object):
+    """
+    On disk cache of parsed geometries, keyed by geometry content hash.
+
+    Entries are JSON files in directory. The least recently used entries are
+    removed by trim() when the cache grows over max_size bytes.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.entries = {}
+        for entry in os.scandir(str(self.directory)):
+            path = pathlib.Path(entry.path)
+            if path.suffix == '.json':
+                stat = entry.stat()
+                self.entries[path.stem] = (stat.st_size, stat.st_mtime)
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        t0 = time.time()
+        path = self.path(key)
+        try:
+            with path.open() as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        # Mark the entry as most recently used
+        os.utime(str(path))
+        self.entries[key] = (self.entries[key][0], time.time())
+
+        self.hits += 1
+        self.saved_time += entry['build_time'] - (time.time() - t0)
+        return entry['faces'], entry['vertices'], entry['uvsets']
+
+    def put(self, key, faces, vertices, uvsets, build_time):
+        write_entry(self.path(key), faces, vertices, uvsets, build_time)
+        self.added(key)
+
+    def added(self, key):
+        """
+        Register the entry written to path(key) by write_entry, as done by
+        geometry worker processes.
+        """
+        self.entries[key] = (self.path(key).stat().st_size, time.time())
+
+    def trim(self):
+        size = sum(size for size, mtime in self.entries.values())
+        by_age = sorted(self.entries.items(), key=lambda item: item[1][1])
+        for key, (entry_size, mtime) in by_age:
+            if size <= self.max_size:
+                break
+            try:
+                self.path(key).unlink()
+            except FileNotFoundError:
+                pass
+            del self.entries[key]
+            size -= entry_size
+
+    def path(self, key):
+        return self.directory / (key + '.json')
+
+    def report(self):
+        return 'Geometry cache: {} hits, {} misses, {:.2f}s saved'.format(
+            self.hits,
+            self.misses,
+            self.saved_time
+        )
+
+
+class TreeCache(object):
+    """
+    On disk copy of the teams/projects/scenes tree of an account, as built by
+    utils.extract_all, and of the last updated plugin check.
+
+    The entry is keyed by a hash of the API root and token. The tree is
+    shown before the first refresh, and is only written again when the hash
+    of the refreshed tree differs. The plugin check is fresh for
+    plugin_check_ttl seconds.
+    """
+    def __init__(self, directory, api_root, api_token, plugin_check_ttl=PLUGIN_CHECK_TTL):
+        self.directory = pathlib.Path(directory)
+        self.plugin_check_ttl = plugin_check_ttl
+
+        key = hashlib.sha1('{}\n{}'.format(api_root, api_token).encode('utf-8')).hexdigest()
+        self.path = self.directory / (key + '.json')
+
+    def load(self):
+        try:
+            with self.path.open() as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, entry):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        write_json(self.path, entry)
+
+    def teams(self):
+        """Return the teams and their hash, None and None when not cached"""
+        entry = self.load()
+        return entry.get('teams'), entry.get('teams_hash')
+
+    def put_teams(self, teams):
+        """Store teams and return their hash"""
+        teams_hash = hashlib.sha1(json.dumps(teams, sort_keys=True).encode('utf-8')).hexdigest()
+        entry = self.load()
+        if entry.get('teams_hash') != teams_hash:
+            entry['teams'] = teams
+            entry['teams_hash'] = teams_hash
+            self.save(entry)
+        return teams_hash
+
+    def updated_plugin(self):
+        """
+        Return whether the plugin check is fresh and its result, None when
+        the plugin is up to date.
+        """
+        entry = self.load()
+        if 'updated_plugin_time' not in entry:
+            return False, None
+        is_fresh = time.time() - entry['updated_plugin_time'] < self.plugin_check_ttl
+        return is_fresh, entry['updated_plugin']
+
+    def put_updated_plugin(self, updated_plugin):
+        entry = self.load()
+        entry['updated_plugin'] = updated_plugin
+        entry['updated_plugin_time'] = time.time()
+        self.save(entry)
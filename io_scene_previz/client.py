@@ -0,0 +1,313 @@
+import asyncio
+import concurrent.futures
+import functools
+import platform
+import threading
+import time
+
+import bpy
+import previz
+import requests
+import urllib3
+
+
+POOL_MAXSIZE = 8
+NOT_MODIFIED = 304
+
+
+def plugin_headers():
+    # The add-on module imports this one
+    from . import version_string
+    return {
+        'X-PREVIZ-PLUGIN-NAME': 'io_scene_blender',
+        'X-PREVIZ-PLUGIN-VERSION': version_string,
+        'X-PREVIZ-PLATFORM-NAME': 'Blender',
+        'X-PREVIZ-PLATFORM-VERSION': bpy.app.version_string,
+        'X-PREVIZ-OS-NAME': platform.system(),
+        'X-PREVIZ-OS-VERSION': platform.release(),
+    }
+
+
+class ConnectionStats(object):
+    """
+    Requests sent and connections opened by the sessions of a
+    ClientManager. The latency saved by reusing connections is estimated
+    from the mean time taken to open one.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.connect_time = 0
+        self.lock = threading.Lock()
+
+    def requested(self):
+        with self.lock:
+            self.requests += 1
+
+    def connected(self, duration):
+        with self.lock:
+            self.connections += 1
+            self.connect_time += duration
+
+    @property
+    def reused(self):
+        return max(0, self.requests - self.connections)
+
+    @property
+    def saved_time(self):
+        if self.connections == 0:
+            return 0
+        return self.reused * self.connect_time / self.connections
+
+    def report(self):
+        mask = 'Previz connections: {} requests, {} connections opened, {} reused, ~{:.0f} ms saved'
+        return mask.format(self.requests, self.connections, self.reused, self.saved_time * 1000)
+
+
+def timed_pool_classes(stats):
+    """
+    urllib3 connection pool classes adding the time taken to open their
+    connections to stats.
+    """
+    def timed(connection_class):
+        class TimedConnection(connection_class):
+            def connect(self):
+                t0 = time.perf_counter()
+                super().connect()
+                stats.connected(time.perf_counter() - t0)
+        return TimedConnection
+
+    class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+        ConnectionCls = timed(urllib3.HTTPConnectionPool.ConnectionCls)
+
+    class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+        ConnectionCls = timed(urllib3.HTTPSConnectionPool.ConnectionCls)
+
+    return {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class ConditionalCache(object):
+    """
+    Last responses to GET requests that came with an ETag or Last-Modified
+    validator, keyed by URL and parameters. The requests are sent again with
+    If-None-Match and If-Modified-Since, and the stored response is returned
+    when the server answers 304 Not Modified.
+    """
+    def __init__(self):
+        self.responses = {}
+        self.revalidated = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(url, params):
+        return (url, tuple(sorted((params or {}).items())))
+
+    def headers(self, key):
+        with self.lock:
+            response = self.responses.get(key)
+        if response is None:
+            return {}
+        headers = {}
+        if 'ETag' in response.headers:
+            headers['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            headers['If-Modified-Since'] = response.headers['Last-Modified']
+        return headers
+
+    def update(self, key, response):
+        with self.lock:
+            if response.status_code == NOT_MODIFIED and key in self.responses:
+                self.revalidated += 1
+                return self.responses[key]
+            if response.ok and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+                self.responses[key] = response
+            return response
+
+
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = timed_pool_classes(self.stats)
+
+
+class PrevizClient(previz.PrevizProject):
+    """
+    PrevizProject sending its requests with a shared requests.Session, so
+    they reuse its connections, and with the plugin headers. GET requests
+    are revalidated with conditional, if given.
+    """
+    def __init__(self, root, token, project_id=None, session=None, stats=None, conditional=None):
+        super().__init__(root, token, project_id)
+        self.session = session if session is not None else requests.Session()
+        self.stats = stats if stats is not None else ConnectionStats()
+        self.conditional = conditional
+        self.custom_headers = plugin_headers()
+
+    def request(self, method, url, **kwargs):
+        key = None
+        if method == 'GET' and self.conditional is not None:
+            key = self.conditional.key(url, kwargs.get('params'))
+
+        headers = {}
+        headers.update(self.common_headers)
+        headers.update(self.custom_headers)
+        if key is not None:
+            headers.update(self.conditional.headers(key))
+        headers.update(kwargs.get('headers', {}))
+        kwargs['headers'] = headers
+
+        # As PrevizProject
+        kwargs.setdefault('verify', False)
+
+        self.stats.requested()
+        response = self.session.request(method, url, **kwargs)
+        if key is not None:
+            response = self.conditional.update(key, response)
+        return response
+
+
+class AsyncPrevizClient(object):
+    """
+    Coroutine versions of the PrevizClient methods. The blocking calls run
+    in the executor of the running loop, so independent requests awaited
+    together are sent concurrently.
+    """
+    def __init__(self, project):
+        self.project = project
+
+    def __getattr__(self, name):
+        method = getattr(self.project, name)
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+
+        return call
+
+
+class LoopThread(object):
+    """
+    asyncio event loop running in a daemon thread, started on the first
+    submit. Coroutines can be submitted from any thread and blocking calls
+    run in an executor of up to max_workers threads.
+    """
+    def __init__(self, max_workers=POOL_MAXSIZE):
+        self.max_workers = max_workers
+        self.loop = None
+        self.thread = None
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def submit(self, coroutine):
+        """Return a concurrent.futures.Future of the coroutine result"""
+        with self.lock:
+            if self.loop is None:
+                self.start()
+            return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers,
+                                                              thread_name_prefix='previz-request')
+        self.loop.set_default_executor(self.executor)
+        self.thread = threading.Thread(target=self.run_forever, name='previz-loop', daemon=True)
+        self.thread.start()
+
+    def run_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.cancel_all(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            # Requests being sent cannot be interrupted
+            self.executor.shutdown(wait=False)
+            self.loop = self.thread = self.executor = None
+
+    @staticmethod
+    async def cancel_all():
+        current = asyncio.current_task()
+        pending = [t for t in asyncio.all_tasks() if t is not current]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+class ClientManager(object):
+    """
+    Process-wide PrevizClient factory. The clients of an API root and token
+    share a session, keeping up to pool_maxsize connections per host alive,
+    and a ConditionalCache.
+
+    Sessions can be used from several task threads at once.
+    """
+    def __init__(self, pool_maxsize=POOL_MAXSIZE):
+        self.pool_maxsize = pool_maxsize
+        self.sessions = {}
+        self.conditional_caches = {}
+        self.stats = ConnectionStats()
+        self.reported_requests = 0
+        self.lock = threading.Lock()
+
+    def project(self, api_root, api_token, project_id=None):
+        session, conditional = self.session(api_root, api_token)
+        return PrevizClient(api_root,
+                            api_token,
+                            project_id,
+                            session,
+                            self.stats,
+                            conditional)
+
+    def async_project(self, api_root, api_token, project_id=None):
+        return AsyncPrevizClient(self.project(api_root, api_token, project_id))
+
+    def session(self, api_root, api_token):
+        key = (previz.normalize_api_root(api_root), api_token)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                for prefix in ('http://', 'https://'):
+                    adapter = TimedHTTPAdapter(self.stats,
+                                               pool_connections=self.pool_maxsize,
+                                               pool_maxsize=self.pool_maxsize)
+                    session.mount(prefix, adapter)
+                self.sessions[key] = session
+                self.conditional_caches[key] = ConditionalCache()
+            return session, self.conditional_caches[key]
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+            self.conditional_caches = {}
+
+    def report(self):
+        with self.lock:
+            revalidated = sum(c.revalidated for c in self.conditional_caches.values())
+        return '{}, {} responses not modified'.format(self.stats.report(), revalidated)
+
+    def new_report(self):
+        """
+        report() if requests were sent since the last new_report(), None
+        otherwise.
+        """
+        with self.lock:
+            if self.stats.requests == self.reported_requests:
+                return None
+            self.reported_requests = self.stats.requests
+        return self.report()
+
+
+clients = ClientManager()
+loop_thread = LoopThread()
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import pathlib
+
+import previz
+
+
+PATCH_CONTENT_TYPE = 'application/vnd.previz.scene-patch+json'
+
+# Responses meaning the server cannot apply the patch, either because it
+# does not support patches or because its scene is not the one the patch
+# was computed against
+PATCH_REJECTED_STATUS_CODES = (404, 405, 409, 412, 415, 501)
+
+
+def hash_json(value):
+    s = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def normalize(document):
+    """
+    Replace the random uuids of a three.js document by stable ones.
+
+    Geometries get a uuid built from their content and objects a uuid built
+    from their name, so unchanged items keep their uuid between exports.
+    Returns the manifest of the document: the hashes of its root, objects
+    and geometries, keyed by uuid.
+    """
+    geometry_uuids = {}
+    geometries = {}
+    unique_geometries = []
+    for geometry in document['geometries']:
+        geometry_hash = hash_json(geometry['data'])
+        uuid = previz.buildUuid('geometry:' + geometry_hash)
+        geometry_uuids[geometry['uuid']] = uuid
+        geometry['uuid'] = uuid
+        if uuid not in geometries:
+            geometries[uuid] = geometry_hash
+            unique_geometries.append(geometry)
+    document['geometries'] = unique_geometries
+
+    root = document['object']
+    root['uuid'] = previz.buildUuid('scene')
+
+    objects = {}
+    for o in root['children']:
+        o['uuid'] = previz.buildUuid('object:' + o['name'])
+        o['geometry'] = geometry_uuids[o['geometry']]
+        objects[o['uuid']] = hash_json(o)
+
+    root_without_children = dict((k, v) for k, v in root.items() if k != 'children')
+    manifest = {
+        'root': hash_json([root_without_children, document['metadata']]),
+        'objects': objects,
+        'geometries': geometries
+    }
+    manifest['hash'] = hash_json(manifest)
+    return manifest
+
+
+def diff(base_manifest, manifest, document):
+    """
+    Build the patch turning the scene described by base_manifest into
+    document.
+    """
+    def changes(name, items):
+        base = base_manifest[name]
+        new = manifest[name]
+        return {
+            'removed': sorted(uuid for uuid in base if uuid not in new),
+            'set': [item for item in items if base.get(item['uuid']) != new[item['uuid']]]
+        }
+
+    root = document['object']
+    patch = {
+        'base': base_manifest['hash'],
+        'hash': manifest['hash'],
+        'geometries': changes('geometries', document['geometries']),
+        'objects': changes('objects', root['children']),
+    }
+
+    if base_manifest['root'] != manifest['root']:
+        patch['metadata'] = document['metadata']
+        patch['object'] = dict((k, v) for k, v in root.items() if k != 'children')
+
+    return patch
+
+
+def is_empty(patch):
+    return 'object' not in patch \
+           and all(len(patch[name][change]) == 0
+                   for name in ('geometries', 'objects')
+                   for change in ('removed', 'set'))
+
+
+class ManifestStore(object):
+    """
+    Manifests of the last published version of each scene, as JSON files
+    in directory.
+    """
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+
+    def load(self, api_root, scene_id):
+        try:
+            with self.path(api_root, scene_id).open() as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, api_root, scene_id, manifest):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(api_root, scene_id)
+        tmp_path = path.with_suffix('.tmp')
+        with tmp_path.open('w') as fp:
+            json.dump(manifest, fp)
+        os.replace(str(tmp_path), str(path))
+
+    def remove(self, api_root, scene_id):
+        try:
+            self.path(api_root, scene_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    def path(self, api_root, scene_id):
+        key = hashlib.sha1((api_root + '\n' + scene_id).encode('utf-8')).hexdigest()
+        return self.directory / (key + '.json')
+
+
+def send_patch(project, json_url, patch):
+    """
+    Send patch to json_url.
+
+    Returns False if the server rejected the patch and the scene has to be
+    uploaded in full.
+    """
+    r = project.request('PATCH',
+                        json_url,
+                        data=json.dumps(patch).encode('utf-8'),
+                        headers={'Content-Type': PATCH_CONTENT_TYPE})
+    if r.status_code in PATCH_REJECTED_STATUS_CODES:
+        return False
+    r.raise_for_status()
+    return True
@@ -0,0 +1,254 @@
+# Geometry building from mesh buffers. This module must not depend on bpy,
+# as it is also imported by the geometry worker processes.
+
+import collections
+import json
+import time
+
+import numpy
+
+import previz
+
+from . import cache
+
+
+Precision = collections.namedtuple('Precision', ['mode', 'value'])
+
+PRECISION_ROUND = 'ROUND'
+PRECISION_QUANTIZE = 'QUANTIZE'
+
+
+FACE_TYPE_QUAD = 1 << 0
+FACE_TYPE_UVS = 1 << 3
+
+
+EncodedGeometry = collections.namedtuple('EncodedGeometry', ['uuid', 'json'])
+
+
+GeometryBuffers = collections.namedtuple('GeometryBuffers',
+                                         ['name',
+                                          'vertices',
+                                          'loop_vertices',
+                                          'polygon_loop_starts',
+                                          'polygon_loop_totals',
+                                          'ngon_triangle_loops',
+                                          'ngon_triangle_polygons',
+                                          'uvsets'])
+
+
+def concatenated_ranges(starts, sizes):
+    """
+    Concatenate range(start, start+size) for each start and size pair.
+    """
+    offsets = numpy.zeros(len(sizes), dtype=numpy.int64)
+    numpy.cumsum(sizes[:-1], out=offsets[1:])
+    ranks = numpy.arange(sizes.sum()) - numpy.repeat(offsets, sizes)
+    return numpy.repeat(starts, sizes) + ranks
+
+
+def polygon_faces(loop_starts, loop_totals, ngon_triangle_loops, ngon_triangle_polygons):
+    """
+    Build triangles and quads from the mesh polygons.
+
+    Triangles and quads are kept as they are, ngons are replaced by their
+    loop triangles. Faces keep the polygons order.
+    Returns the corner loops and the size of each face.
+    """
+    is_simple = loop_totals <= 4
+    simple_polygons = numpy.flatnonzero(is_simple)
+    simple_sizes = loop_totals[is_simple]
+    simple_loops = concatenated_ranges(loop_starts[is_simple], simple_sizes)
+
+    face_polygons = numpy.concatenate((simple_polygons, ngon_triangle_polygons))
+    face_sizes = numpy.concatenate((
+        simple_sizes,
+        numpy.full(len(ngon_triangle_polygons), 3, dtype=simple_sizes.dtype)
+    ))
+    loops = numpy.concatenate((simple_loops, ngon_triangle_loops.ravel()))
+
+    face_starts = numpy.zeros(len(face_sizes), dtype=numpy.int64)
+    numpy.cumsum(face_sizes[:-1], out=face_starts[1:])
+
+    order = numpy.argsort(face_polygons, kind='stable')
+    face_sizes = face_sizes[order]
+    return loops[concatenated_ranges(face_starts[order], face_sizes)], face_sizes
+
+
+def build_faces(corner_vertices, face_sizes, corner_uvs):
+    """
+    Build the three.js faces stream from flat per corner vertex indices.
+
+    corner_uvs holds the per corner UV indices of each UV set.
+    See https://github.com/mrdoob/three.js/wiki/JSON-Model-format-3
+    """
+    faces_count = len(face_sizes)
+    uvsets_count = len(corner_uvs)
+
+    records_sizes = 1 + face_sizes*(1 + uvsets_count)
+    records_starts = numpy.zeros(faces_count, dtype=numpy.int64)
+    numpy.cumsum(records_sizes[:-1], out=records_starts[1:])
+
+    faces = numpy.empty(records_sizes.sum(), dtype=numpy.int64)
+
+    faces[records_starts] = (face_sizes == 4)*FACE_TYPE_QUAD \
+                            + (uvsets_count > 0)*FACE_TYPE_UVS
+
+    corner_faces = numpy.repeat(numpy.arange(faces_count), face_sizes)
+    positions = concatenated_ranges(records_starts + 1, face_sizes)
+    faces[positions] = corner_vertices
+    corner_sizes = face_sizes[corner_faces]
+    for uv_indices in corner_uvs:
+        positions += corner_sizes
+        faces[positions] = uv_indices
+
+    return faces
+
+
+def weld_uvs(uvs):
+    """
+    Merge identical UV coordinates.
+
+    Returns the distinct coordinates, in order of first use, and the index
+    of each of the uvs in them.
+    """
+    if len(uvs) == 0:
+        return uvs, numpy.zeros(0, dtype=numpy.int64)
+
+    distinct, first_uses, indices = numpy.unique(uvs,
+                                                 axis=0,
+                                                 return_index=True,
+                                                 return_inverse=True)
+    order = numpy.argsort(first_uses)
+    ranks = numpy.empty_like(order)
+    ranks[order] = numpy.arange(len(order))
+    return distinct[order], ranks[indices.reshape(-1)]
+
+
+def reduce_precision(values, precision):
+    """
+    Reduce the precision of an array of coordinates, one row per point.
+
+    precision is None to keep full precision, or a Precision:
+    - PRECISION_ROUND rounds to value decimals
+    - PRECISION_QUANTIZE snaps each component to a grid of 2**value steps
+      over its bounding box, and rounds to the decimals telling the steps
+      apart
+    """
+    if precision is None or len(values) == 0:
+        return values
+
+    values = values.astype(numpy.float64)
+    if precision.mode == PRECISION_ROUND:
+        return numpy.round(values, precision.value)
+
+    low = values.min(axis=0)
+    step = (values.max(axis=0) - low) / ((1 << precision.value) - 1)
+    step[step == 0] = 1
+    values = low + numpy.round((values - low) / step)*step
+    decimals = max(0, int(numpy.ceil(numpy.log10(2 / step.min()))))
+    return numpy.round(values, decimals)
+
+
+def build_geometry_data(buffers, precision=None, weld=False):
+    """
+    Build the three.js JSON geometry arrays.
+
+    Without weld, each face corner gets its own UV index, shared by all the
+    UV sets. With weld, each UV set only holds its distinct coordinates and
+    gets its own UV indices.
+    """
+    corner_loops, face_sizes = polygon_faces(
+        buffers.polygon_loop_starts,
+        buffers.polygon_loop_totals,
+        buffers.ngon_triangle_loops,
+        buffers.ngon_triangle_polygons
+    )
+    corner_vertices = buffers.loop_vertices[corner_loops]
+    corner_numbers = numpy.arange(len(corner_loops))
+
+    uvsets = []
+    corner_uvs = []
+    for name, uvs in buffers.uvsets:
+        uvs = reduce_precision(uvs, precision)[corner_loops]
+        uv_indices = corner_numbers
+        if weld:
+            uvs, uv_indices = weld_uvs(uvs)
+        uvsets.append(previz.UVSet(name, uvs.ravel().tolist()))
+        corner_uvs.append(uv_indices)
+
+    faces = build_faces(corner_vertices, face_sizes, corner_uvs)
+    vertices = reduce_precision(buffers.vertices, precision)
+    return buffers.name, faces.tolist(), vertices.ravel().tolist(), uvsets
+
+
+def triangulate(corner_loops, face_sizes):
+    """
+    Split the triangles and quads built by polygon_faces into triangles.
+    """
+    face_starts = numpy.zeros(len(face_sizes), dtype=numpy.int64)
+    numpy.cumsum(face_sizes[:-1], out=face_starts[1:])
+
+    triangles_counts = face_sizes - 2
+    starts = numpy.repeat(face_starts, triangles_counts)
+    ranks = concatenated_ranges(numpy.zeros(len(face_sizes), dtype=numpy.int64), triangles_counts)
+    corners = numpy.column_stack((starts, starts + ranks + 1, starts + ranks + 2))
+    return corner_loops[corners]
+
+
+def build_buffer_geometry_data(buffers, precision=None):
+    """
+    Build the indexed BufferGeometry arrays: positions and UVs per loop,
+    and the loop indices of the triangles.
+    """
+    corner_loops, face_sizes = polygon_faces(
+        buffers.polygon_loop_starts,
+        buffers.polygon_loop_totals,
+        buffers.ngon_triangle_loops,
+        buffers.ngon_triangle_polygons
+    )
+    index = triangulate(corner_loops, face_sizes)
+    position = reduce_precision(buffers.vertices, precision)[buffers.loop_vertices]
+    uvsets = [previz.UVSet(name, reduce_precision(uvs, precision)) for name, uvs in buffers.uvsets]
+    return buffers.name, index, position, uvsets
+
+
+def build_geometry_document(generator, name, faces, vertices, uvsets):
+    """
+    Same as previz.build_geometry, for faces, vertices and UVs that are
+    already flat lists.
+    """
+    return {
+        'data': {
+            'metadata': {
+                'version': 3,
+                'generator': generator,
+            },
+            'name': name,
+            'faces': faces,
+            'uvs': [uvset.coordinates for uvset in uvsets],
+            'vertices': vertices
+        },
+        'uuid': previz.buildUuid(),
+        'type': 'Geometry'
+    }
+
+
+def encode_json(value):
+    return json.dumps(value, indent=1, sort_keys=True)
+
+
+def encode_geometry(generator, buffers, precision=None, weld=False, cache_path=None):
+    """
+    Build and encode the three.js JSON geometry of buffers, in a geometry
+    worker process.
+
+    When cache_path is given, the geometry data is also written there as a
+    geometry cache entry.
+    """
+    t0 = time.time()
+    name, faces, vertices, uvsets = build_geometry_data(buffers, precision, weld)
+    if cache_path is not None:
+        cache.write_entry(cache_path, faces, vertices, uvsets, time.time() - t0)
+
+    geometry = build_geometry_document(generator, name, faces, vertices, uvsets)
+    return EncodedGeometry(geometry['uuid'], encode_json(geometry))
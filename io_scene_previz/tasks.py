@@ -1,11 +1,17 @@
+import asyncio
 import bpy
-import platform
-import previz
+import json
 import queue
+import shutil
 import sys
 import threading
 import time
 
+from . import client
+from . import delta
+from . import three_js_exporter
+from . import upload
+
 
 def id_generator():
     id = -1
@@ -14,13 +20,71 @@ def id_generator():
         yield id
 
 
+MAX_RUNNING_TASKS = 4
+DEFAULT_CONCURRENCY = {'publish': 1}
+MIN_POLL_INTERVAL = .01 # s
+MAX_POLL_INTERVAL = .25 # s
+MAX_CHANGE_NOTIFY_RATE = 10 # per s
+MAX_RESULTS_BATCH = 256
+
+
+class TaskChannel(object):
+    """
+    queue_to_main of a WorkerTask. The messages are posted to the results of
+    the TasksRunner of the task.
+    """
+    def __init__(self, task):
+        self.task = task
+
+    def put(self, msg):
+        self.task.tasks_runner.post(self.task, msg)
+
+
 class TasksRunner(object):
-    def __init__(self, keep_finished_task_timeout = 2):
+    """
+    Added tasks are queued, and started by priority then in order of
+    addition. At most max_running tasks run at once, and at most
+    concurrency[group] tasks of a Task.concurrency_group.
+
+    Worker threads post their messages to one results queue, which tick
+    drains by batches of max_results_batch messages, handing them to the
+    tasks. poll ticks and returns when to poll again: soon while tasks run or
+    after results were posted, then backing off up to max_poll_interval
+    while no task runs.
+
+    Task changes are coalesced into one on_task_changed call per tick, at
+    most max_change_notify_rate times per second. The callbacks get the
+    runner and None.
+    """
+    def __init__(self,
+                 keep_finished_task_timeout = 2,
+                 max_running = MAX_RUNNING_TASKS,
+                 concurrency = None,
+                 min_poll_interval = MIN_POLL_INTERVAL,
+                 max_poll_interval = MAX_POLL_INTERVAL,
+                 max_change_notify_rate = MAX_CHANGE_NOTIFY_RATE,
+                 max_results_batch = MAX_RESULTS_BATCH):
         self.keep_finished_task_timeout = keep_finished_task_timeout
+        self.max_running = max_running
+        self.concurrency = dict(DEFAULT_CONCURRENCY if concurrency is None else concurrency)
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+
+        self.poll_interval = min_poll_interval
+        self.results = queue.Queue()
+        self.max_results_batch = max_results_batch
+        self.results_posted = threading.Event()
+        self.is_ticking = False
+
+        self.max_change_notify_rate = max_change_notify_rate
+        self.has_changes = False
+        self.last_change_notify_date = None
+        self.change_notify_delay = None
 
         self.tasks = {}
         self.on_task_changed = []
         self.on_queue_started = []
+        self.on_task_added = []
 
         self.id_generator = id_generator()
 
@@ -29,22 +93,98 @@ class TasksRunner(object):
         task.tasks_runner = self
         self.tasks[id] = task
 
-        task.run(context)
+        task.queued()
+        self.start_tasks(context)
+        self.wake()
 
         if len(self.tasks) == 1:
             for cb in self.on_queue_started:
                 cb(self)
 
+        for cb in self.on_task_added:
+            cb(self)
+
         return id
 
+    def post(self, task, msg):
+        """Post a message of a task from any thread"""
+        self.results.put((task, msg))
+        self.wake()
+
+    def wake(self):
+        self.results_posted.set()
+
+    def poll(self, context):
+        """Tick and return the seconds until the next poll, None when empty"""
+        results_posted = self.results_posted.is_set()
+        self.results_posted.clear()
+
+        self.tick(context)
+
+        # Worker results are only read when polling, keep polling soon while
+        # tasks run
+        if results_posted or self.is_running:
+            self.poll_interval = self.min_poll_interval
+        else:
+            self.poll_interval = min(2 * self.poll_interval, self.max_poll_interval)
+
+        if self.is_empty:
+            self.notify_changes(force=True)
+            return None
+        if self.change_notify_delay is not None:
+            return min(self.poll_interval, self.change_notify_delay)
+        return self.poll_interval
+
     def tick(self, context):
-        for task in self.tasks.values():
-            task.tick(context)
-        self.remove_finished_tasks()
+        self.is_ticking = True
+        try:
+            self.handle_results(context)
+            self.start_tasks(context)
+            self.remove_finished_tasks()
+            self.change_notify_delay = self.notify_changes()
+        finally:
+            self.is_ticking = False
+
+    def handle_results(self, context):
+        for i in range(self.max_results_batch):
+            try:
+                task, (msg, data) = self.results.get_nowait()
+            except queue.Empty:
+                return
+            # Tasks can add tasks when they finish
+            task.handle(context, msg, data)
+
+        # Handle the rest at the next poll
+        if not self.results.empty():
+            self.wake()
+
+    def start_tasks(self, context):
+        queued = [t for t in self.tasks.values() if t.status == QUEUED]
+        # Sorting is stable, tasks of a priority keep their order
+        for task in sorted(queued, key=lambda t: t.priority):
+            # Starting a task can start others
+            if task.status == QUEUED and self.can_start(task):
+                task.run(context)
+
+    def can_start(self, task):
+        running = [t for t in self.tasks.values() if t.status in (RUNNING, CANCELING)]
+        if len(running) >= self.max_running:
+            return False
+        limit = self.concurrency.get(task.concurrency_group)
+        if limit is None:
+            return True
+        group = [t for t in running if t.concurrency_group == task.concurrency_group]
+        return len(group) < limit
+
+    def cancel_task(self, task):
+        if task.status == QUEUED:
+            task.canceled()
+        else:
+            task.cancel()
 
     def cancel(self):
-        for task in [t for t in self.tasks.values() if t.is_cancelable]:
-            task.cancel()
+        for task in [t for t in self.tasks.values() if t.is_cancelable and not t.is_finished]:
+            self.cancel_task(task)
 
     def remove_finished_tasks(self):
         def is_timed_out(task):
@@ -59,6 +199,10 @@ class TasksRunner(object):
     def is_empty(self):
         return len(self.tasks) == 0
 
+    @property
+    def is_running(self):
+        return any(t.status in (RUNNING, CANCELING) for t in self.tasks.values())
+
     @property
     def is_finished(self):
         tasks = self.tasks.values()
@@ -73,8 +217,28 @@ class TasksRunner(object):
         del self.tasks[task_id]
 
     def notify_change(self, task):
+        # Notified by the next tick
+        self.has_changes = True
+        self.wake()
+
+    def notify_changes(self, force=False):
+        """
+        Call on_task_changed if tasks changed, and return the seconds to
+        wait before it can be called, None if it was called.
+        """
+        if not self.has_changes:
+            return None
+
+        if not force and self.last_change_notify_date is not None:
+            delay = self.last_change_notify_date + 1 / self.max_change_notify_rate - time.time()
+            if delay > 0:
+                return delay
+
+        self.has_changes = False
+        self.last_change_notify_date = time.time()
         for cb in self.on_task_changed:
-            cb(self, task)
+            cb(self, None)
+        return None
 
     def new_task_id(self):
         return next(self.id_generator)
@@ -83,6 +247,7 @@ class TasksRunner(object):
 tasks_runner = None
 
 IDLE = 'idle'
+QUEUED = 'queued'
 STARTING = 'starting'
 RUNNING = 'running'
 DONE = 'done'
@@ -91,7 +256,15 @@ CANCELED = 'canceled'
 ERROR = 'error'
 
 
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+
 class Task(object):
+    priority = PRIORITY_NORMAL
+    concurrency_group = None
+
     def __init__(self):
         self.label = 'label'
         self.status = IDLE
@@ -101,6 +274,11 @@ class Task(object):
         self.finished_time = None
         self.tasks_runner = None
 
+    def queued(self):
+        self.state = 'Queued'
+        self.status = QUEUED
+        self.notify()
+
     def run(self, context):
         self.state = 'Running'
         self.status = RUNNING
@@ -132,13 +310,17 @@ class Task(object):
 
     @property
     def is_cancelable(self):
-        return hasattr(self, 'cancel')
+        return self.status == QUEUED or hasattr(self, 'cancel')
+
+    @property
+    def is_running(self):
+        return any(t.status in (RUNNING, CANCELING) for t in self.tasks.values())
 
     @property
     def is_finished(self):
         return self.status in (DONE, CANCELED, ERROR)
 
-    def tick(self, context):
+    def handle(self, context, msg, data):
         pass
 
     def notify(self):
@@ -152,29 +334,32 @@ TASK_UPDATE = 'TASK_UPDATE'
 TASK_ERROR = 'TASK_ERROR'
 
 
-class RefreshAllTask(Task):
-    def __init__(
-            self,
-            api_root,
-            api_token,
-            version_string,
-            on_get_all,
-            on_updated_plugin):
-        Task.__init__(self)
+class WorkerTask(Task):
+    """
+    Task run by a worker posting messages to queue_to_main.
 
-        self.on_get_all = on_get_all
-        self.on_updated_plugin = on_updated_plugin
+    Subclasses define either a static thread_run(queue_to_worker,
+    queue_to_main, **kwargs) run in a thread, or a static coroutine
+    async_run(queue_to_main, **kwargs) run on client.loop_thread, kwargs
+    being the keyword arguments given to __init__. Workers post
+    (TASK_UPDATE, (request, data)), then (TASK_DONE, data) or
+    (TASK_ERROR, exc_info), handled by update and finish on the main
+    thread.
+
+    When cancelable, cancel sends REQUEST_CANCEL to queue_to_worker and
+    the worker answers RESPOND_CANCELED.
+    """
+    label = 'label'
+    cancelable = False
+
+    def __init__(self, **kwargs):
+        Task.__init__(self)
 
-        self.label = 'Refresh'
+        self.label = type(self).label
+        self.kwargs = kwargs
 
         self.queue_to_worker = queue.Queue()
-        self.queue_to_main = queue.Queue()
-        self.thread = threading.Thread(target=RefreshAllTask.thread_run,
-                                       args=(self.queue_to_worker,
-                                             self.queue_to_main,
-                                             api_root,
-                                             api_token,
-                                             version_string))
+        self.queue_to_main = TaskChannel(self)
 
     def run(self, context):
         super().run(context)
@@ -182,29 +367,93 @@ class RefreshAllTask(Task):
         self.progress = 0
         self.notify()
 
-        self.thread.start()
+        if hasattr(self, 'async_run'):
+            client.loop_thread.submit(self.async_run(self.queue_to_main, **self.kwargs))
+        else:
+            thread = threading.Thread(target=self.thread_run,
+                                      args=(self.queue_to_worker,
+                                            self.queue_to_main),
+                                      kwargs=self.kwargs)
+            thread.start()
+
+    @property
+    def is_cancelable(self):
+        return self.status == QUEUED or self.cancelable
+
+    def cancel(self):
+        self.canceling()
+        self.queue_to_worker.put((REQUEST_CANCEL, None))
+
+    def handle(self, context, msg, data):
+        if self.is_finished:
+            return
+
+        if msg == TASK_UPDATE:
+            request, data = data
+            self.update(context, request, data)
+
+        if msg == TASK_DONE:
+            self.finish(context, data)
+            self.progress = 1
+            self.done()
+
+        if msg == TASK_ERROR:
+            exc_info = data
+            self.set_error(exc_info)
+
+        if msg == RESPOND_CANCELED:
+            self.canceled()
+
+    def update(self, context, request, data):
+        pass
+
+    def finish(self, context, data):
+        pass
+
+
+class RefreshAllTask(WorkerTask):
+    """
+    Get the teams/projects/scenes tree, or only the teams when lazy, and
+    unless on_updated_plugin is None, check for a plugin update.
+    """
+    label = 'Refresh'
+    priority = PRIORITY_INTERACTIVE
+
+    def __init__(
+            self,
+            api_root,
+            api_token,
+            version_string,
+            on_get_all,
+            on_updated_plugin=None,
+            lazy=False):
+        WorkerTask.__init__(self,
+                            api_root=api_root,
+                            api_token=api_token,
+                            version_string=version_string,
+                            check_plugin=on_updated_plugin is not None,
+                            lazy=lazy)
+
+        self.on_get_all = on_get_all
+        self.on_updated_plugin = on_updated_plugin
+
+        self.requests_count = 1 if on_updated_plugin is None else 2
 
     @staticmethod
-    def thread_run(queue_to_worker, queue_to_main, api_root, api_token, version_string):
-        p = previz.PrevizProject(api_root, api_token)
-
-        p.custom_headers = {
-            'X-PREVIZ-PLUGIN-NAME': 'io_scene_blender',
-            'X-PREVIZ-PLUGIN-VERSION': '1.2.1',
-            'X-PREVIZ-PLATFORM-NAME': 'Blender',
-            'X-PREVIZ-PLATFORM-VERSION': bpy.app.version_string,
-            'X-PREVIZ-OS-NAME': platform.system(),
-            'X-PREVIZ-OS-VERSION': platform.release(),
-        }
+    async def async_run(queue_to_main, api_root, api_token, version_string, check_plugin=True, lazy=False):
+        p = client.clients.async_project(api_root, api_token)
 
-        try:
-            data = ('get_all', p.get_all())
+        async def request(name, *args):
+            data = (name, await getattr(p, name)(*args))
             msg = (TASK_UPDATE, data)
             queue_to_main.put(msg)
 
-            data = ('updated_plugin', p.updated_plugin('blender', version_string))
-            msg = (TASK_UPDATE, data)
-            queue_to_main.put(msg)
+        try:
+            # The requests do not depend on each other
+            requests = [request('teams', []) if lazy else request('get_all')]
+            if check_plugin:
+                requests.append(request('updated_plugin', 'blender', version_string))
+            await asyncio.gather(*requests)
 
             msg = (TASK_DONE, None)
             queue_to_main.put(msg)
@@ -212,71 +461,81 @@ class RefreshAllTask(Task):
             msg = (TASK_ERROR, sys.exc_info())
             queue_to_main.put(msg)
 
-    def tick(self, context):
-        while not self.queue_to_main.empty():
-            msg, data = self.queue_to_main.get()
+    def update(self, context, request, data):
+        self.progress += 1 / self.requests_count
+        self.notify()
 
-            if not self.is_finished:
-                if msg == TASK_DONE:
-                    self.done()
+        if request in ('get_all', 'teams'):
+            self.on_get_all(context, data)
 
-                if msg == TASK_UPDATE:
-                    self.progress += .5
-                    self.notify()
+        if request == 'updated_plugin':
+            self.on_updated_plugin(context, data)
 
-                    request, data = data
 
-                    if request == 'get_all':
-                        self.on_get_all(context, data)
+class GetChildrenTask(WorkerTask):
+    """
+    Get a team with its 'projects' or a project with its 'scenes', as
+    loaded on demand in lazy tree mode.
+    """
+    priority = PRIORITY_INTERACTIVE
 
-                    if request == 'updated_plugin':
-                        self.on_updated_plugin(context, data)
+    def __init__(self, api_root, api_token, name, item_id, on_done):
+        WorkerTask.__init__(self,
+                            api_root=api_root,
+                            api_token=api_token,
+                            name=name,
+                            item_id=item_id)
 
-                if msg == TASK_ERROR:
-                    exc_info = data
-                    self.set_error(exc_info)
+        self.name = name
+        self.item_id = item_id
+        self.on_done = on_done
 
-            self.queue_to_main.task_done()
+        self.label = 'Load ' + name
+
+    @staticmethod
+    async def async_run(queue_to_main, api_root, api_token, name, item_id):
+        try:
+            if name == 'projects':
+                p = client.clients.async_project(api_root, api_token)
+                data = await p.team(item_id, include=['projects'])
+            else:
+                p = client.clients.async_project(api_root, api_token, item_id)
+                data = await p.project(include=['scenes'])
+
+            msg = (TASK_DONE, data)
+            queue_to_main.put(msg)
+        except Exception:
+            msg = (TASK_ERROR, sys.exc_info())
+            queue_to_main.put(msg)
+
+    def finish(self, context, data):
+        self.on_done(context, data)
 
 
-class CreateProjectTask(Task):
+class CreateProjectTask(WorkerTask):
+    label = 'New project'
+    priority = PRIORITY_INTERACTIVE
+
     def __init__(self,
             on_done,
             **kwargs):
-        Task.__init__(self)
+        WorkerTask.__init__(self, **kwargs)
 
         self.on_done = on_done
 
-        self.label = 'New project'
-
         self.project = None
 
-        self.queue_to_worker = queue.Queue()
-        self.queue_to_main = queue.Queue()
-
-        self.thread = threading.Thread(target=CreateProjectTask.thread_run,
-                                       args=(self.queue_to_worker,
-                                             self.queue_to_main),
-                                       kwargs=kwargs)
-
-    def run(self, context):
-        super().run(context)
-
-        self.progress = 0
-        self.notify()
-
-        self.thread.start()
-
     @staticmethod
-    def thread_run(queue_to_worker, queue_to_main, api_root, api_token, project_name, team_uuid):
+    async def async_run(queue_to_main, api_root, api_token, project_name, team_uuid):
         try:
-            p = previz.PrevizProject(api_root, api_token)
+            p = client.clients.async_project(api_root, api_token)
 
-            data = ('new_project', p.new_project(project_name, team_uuid))
+            data = ('new_project', await p.new_project(project_name, team_uuid))
             msg = (TASK_UPDATE, data)
             queue_to_main.put(msg)
 
-            data = ('get_all', p.get_all())
+            # The new project has to be listed
+            data = ('get_all', await p.get_all())
             msg = (TASK_UPDATE, data)
             queue_to_main.put(msg)
 
@@ -286,68 +545,38 @@ class CreateProjectTask(Task):
             msg = (TASK_ERROR, sys.exc_info())
             queue_to_main.put(msg)
 
-    def tick(self, context):
-        while not self.queue_to_main.empty():
-            msg, data = self.queue_to_main.get()
-
-            if not self.is_finished:
-                if msg == TASK_DONE:
-                    self.done()
-
-                if msg == TASK_UPDATE:
-                    self.notify()
-
-                    request, data = data
-
-                    if request == 'new_project':
-                        self.project = data
+    def update(self, context, request, data):
+        self.notify()
 
-                    if request == 'get_all':
-                        self.on_done(context, data, self.project)
+        if request == 'new_project':
+            self.project = data
 
-                if msg == TASK_ERROR:
-                    exc_info = data
-                    self.set_error(exc_info)
+        if request == 'get_all':
+            self.on_done(context, data, self.project)
 
-            self.queue_to_main.task_done()
 
+class CreateSceneTask(WorkerTask):
+    label = 'New scene'
+    priority = PRIORITY_INTERACTIVE
 
-class CreateSceneTask(Task):
     def __init__(self, on_done, **kwargs):
-        Task.__init__(self)
+        WorkerTask.__init__(self, **kwargs)
 
         self.on_done = on_done
 
-        self.label = 'New scene'
-
         self.scene = None
 
-        self.queue_to_worker = queue.Queue()
-        self.queue_to_main = queue.Queue()
-
-        self.thread = threading.Thread(target=CreateSceneTask.thread_run,
-                                       args=(self.queue_to_worker,
-                                             self.queue_to_main),
-                                       kwargs=kwargs)
-
-    def run(self, context):
-        super().run(context)
-
-        self.progress = 0
-        self.notify()
-
-        self.thread.start()
-
     @staticmethod
-    def thread_run(queue_to_worker, queue_to_main, api_root, api_token, scene_name, project_id):
+    async def async_run(queue_to_main, api_root, api_token, scene_name, project_id):
         try:
-            p = previz.PrevizProject(api_root, api_token, project_id)
+            p = client.clients.async_project(api_root, api_token, project_id)
 
-            data = ('new_scene', p.new_scene(scene_name))
+            data = ('new_scene', await p.new_scene(scene_name))
             msg = (TASK_UPDATE, data)
             queue_to_main.put(msg)
 
-            data = ('get_all', p.get_all())
+            # The new scene has to be listed
+            data = ('get_all', await p.get_all())
             msg = (TASK_UPDATE, data)
             queue_to_main.put(msg)
 
@@ -357,66 +586,156 @@ class CreateSceneTask(Task):
             msg = (TASK_ERROR, sys.exc_info())
             queue_to_main.put(msg)
 
-    def tick(self, context):
-        while not self.queue_to_main.empty():
-            msg, data = self.queue_to_main.get()
+    def update(self, context, request, data):
+        self.notify()
 
-            if not self.is_finished:
-                if msg == TASK_DONE:
-                    self.done()
+        if request == 'new_scene':
+            self.scene = data
 
-                if msg == TASK_UPDATE:
-                    self.notify()
+        if request == 'get_all':
+            self.on_done(context, data, self.scene)
 
-                    request, data = data
 
-                    if request == 'new_scene':
-                        self.scene = data
+class SnapshotSceneTask(Task):
+    """
+    Read the scene with three_js_exporter.snapshot_scene in time slices.
 
-                    if request == 'get_all':
-                        self.on_done(context, data, self.scene)
+    bpy data can only be read on the main thread. Each bpy.app.timers call
+    reads objects for slice_duration seconds at most, and Blender handles
+    the user events between the slices. on_done gets the context and the
+    scene once all the objects are read.
+    """
+    def __init__(self, geometries, tracker=None, on_done=None, slice_duration=.01):
+        Task.__init__(self)
 
-                if msg == TASK_ERROR:
-                    exc_info = data
-                    self.set_error(exc_info)
+        self.geometries = geometries
+        self.tracker = tracker
+        self.on_done = on_done
+        self.slice_duration = slice_duration
 
-            self.queue_to_main.task_done()
+        self.label = 'Read scene'
 
+        self.last_progress_notify_date = None
 
-class PrevizCancelUploadException(Exception):
-    pass
+        self.scene = None
+        self.object_names = []
+        self.meshes = []
 
+    def run(self, context):
+        super().run(context)
 
-class PublishSceneTask(Task):
-    def __init__(self, on_done = None, **kwargs):
-        Task.__init__(self)
+        self.progress = 0
+        self.notify()
 
-        self.on_done = on_done
+        # Objects are found again by name at each slice, as they can be
+        # removed in between
+        self.object_names = [o.name for o in three_js_exporter.exportable_objects(context)]
+        self.scene = three_js_exporter.snapshot_scene(context, self.geometries, objects=[])
 
-        self.label = 'Publish scene'
+        # Timers do not run in background mode
+        if bpy.app.background:
+            while self.read_slice() is not None:
+                pass
+            return
 
-        self.last_progress_notify_date = None
+        bpy.app.timers.register(self.read_slice)
 
-        self.queue_to_worker = queue.Queue()
-        self.queue_to_main = queue.Queue()
+    def cancel(self):
+        if bpy.app.timers.is_registered(self.read_slice):
+            bpy.app.timers.unregister(self.read_slice)
+        self.canceled()
 
-        self.thread = threading.Thread(target=PublishSceneTask.thread_run,
-                                       args=(self.queue_to_worker,
-                                             self.queue_to_main),
-                                       kwargs=kwargs)
+    def read_slice(self):
+        t0 = time.time()
+        try:
+            # Read at least one object per slice
+            while len(self.meshes) < len(self.object_names):
+                name = self.object_names[len(self.meshes)]
+                o = bpy.data.objects.get(name)
+                if o is None or o.type != 'MESH':
+                    self.object_names.remove(name)
+                else:
+                    self.meshes.append(three_js_exporter.parse_mesh(o, self.geometries, self.tracker))
+                if time.time() - t0 >= self.slice_duration:
+                    break
+        except Exception:
+            self.set_error(sys.exc_info())
+            return None
+
+        if len(self.meshes) < len(self.object_names):
+            if self.notify_progress:
+                self.last_progress_notify_date = time.time()
+                self.progress = len(self.meshes) / len(self.object_names)
+                self.notify()
+            return 0
+
+        self.progress = 1
+        self.done()
+        if self.on_done is not None:
+            self.on_done(bpy.context, self.scene._replace(objects=self.meshes))
+        return None
 
-    def run(self, context):
-        super().run(context)
+    @property
+    def notify_progress(self):
+        return self.last_progress_notify_date is None \
+               or (time.time() - self.last_progress_notify_date) > .25
 
-        self.thread.start()
 
-    def cancel(self):
-        self.canceling()
-        self.queue_to_worker.put((REQUEST_CANCEL, None))
+class PrevizCancelUploadException(Exception):
+    pass
+
+
+class PublishSceneTask(WorkerTask):
+    label = 'Publish scene'
+    priority = PRIORITY_BACKGROUND
+    concurrency_group = 'publish'
+    cancelable = True
+
+    def __init__(self, on_done = None, on_finished = None, **kwargs):
+        WorkerTask.__init__(self, **kwargs)
+
+        self.on_done = on_done
+        self.on_finished = on_finished
+
+        self.last_progress_notify_date = None
+        self.export_progress = None
+        self.upload_progress = 0
+        self.bytes_read = 0
+        self.bytes_sent = 0
 
     @staticmethod
-    def thread_run(queue_to_worker, queue_to_main, api_root, api_token, project_id, scene_id, export_path):
-        def on_progress(fp, read_size, read_so_far, size):
+    def thread_run(queue_to_worker,
+                   queue_to_main,
+                   api_root,
+                   api_token,
+                   project_id,
+                   scene_id,
+                   export_path=None,
+                   manifests=None,
+                   delta_publish=False,
+                   scene=None,
+                   geometries=None,
+                   buffer_writer=None,
+                   uploads=None,
+                   resume=False):
+        """
+        Upload the scene JSON file at export_path or, when given, the scene
+        read by three_js_exporter.snapshot_scene.
+
+        A snapshot is exported by another thread while it is uploaded, and
+        only a copy is written to export_path when given. The scene is
+        compressed with the best content encoding the server accepts, see
+        upload.ContentEncodings.
+
+        With an upload.UploadStore, the scene is sent in chunks with an
+        upload.ResumableUpload when the server supports it. With resume,
+        the interrupted upload of the scene is resumed instead.
+
+        With delta_publish, only the changes since the manifest of the
+        scene in the delta.ManifestStore manifests are sent. Other publishes
+        remove that manifest, as it no longer describes the server scene.
+        """
+        def check_cancel():
             while not queue_to_worker.empty():
                 msg, data = queue_to_worker.get()
                 queue_to_worker.task_done()
@@ -424,16 +743,72 @@ class PublishSceneTask(Task):
                 if msg == REQUEST_CANCEL:
                     raise PrevizCancelUploadException
 
-            data = ('progress', read_so_far / size)
+        def on_progress(read_so_far, size, sent_so_far):
+            check_cancel()
+
+            data = ('progress', (read_so_far / size, read_so_far, sent_so_far))
             msg = (TASK_UPDATE, data)
             queue_to_main.put(msg)
 
+        def resumable_upload(write_scene):
+            if uploads is None:
+                return False
+            return PublishSceneTask.resumable_upload(p, url, uploads, api_root, scene_id, write_scene, check_cancel, queue_to_main)
+
+        def upload_file(path):
+            upload.upload_scene(p, url, lambda: path.open('rb'), on_progress, path.stat().st_size)
+
+        def copy_file(fp):
+            with export_path.open() as src:
+                shutil.copyfileobj(src, fp)
+
+        def export_scene(snapshot):
+            objects = PublishSceneTask.export_objects(snapshot, geometries, check_cancel, queue_to_main)
+            return snapshot._replace(objects=objects)
+
+        def streamed_upload(write_scene):
+            # Without a snapshot, export_path is the scene to publish and is
+            # left as it was exported
+            def write(fp):
+                PublishSceneTask.write_copy(fp, export_path if scene is not None else None, write_scene)
+            if resumable_upload(write):
+                return
+
+            content_encoding = upload.content_encodings.choose(url)
+            try:
+                PublishSceneTask.pipelined_upload(p, url, write, content_encoding, check_cancel, queue_to_main)
+            except upload.EncodingRejected:
+                # Write the scene again, the server may reject an encoding it
+                # accepted before
+                PublishSceneTask.pipelined_upload(p, url, write, upload.IDENTITY, check_cancel, queue_to_main)
+
+        def upload_document(document):
+            streamed_upload(lambda fp: json.dump(document, fp, indent=1, sort_keys=True))
+
         try:
-            p = previz.PrevizProject(api_root, api_token, project_id)
+            p = client.clients.project(api_root, api_token, project_id)
 
             url = p.scene(scene_id, include=[])['jsonUrl']
-            with export_path.open('rb') as fd:
-                p.update_scene(url, fd, on_progress)
+            if manifests is not None and not delta_publish:
+                manifests.remove(api_root, scene_id)
+
+            if resume:
+                PublishSceneTask.resumable_upload(p, url, uploads, api_root, scene_id, None, check_cancel, queue_to_main)
+            elif scene is None:
+                if not delta_publish:
+                    if not resumable_upload(copy_file):
+                        upload_file(export_path)
+                else:
+                    with export_path.open() as fp:
+                        document = json.load(fp)
+                    PublishSceneTask.delta_upload(p, url, manifests, api_root, scene_id, document, upload_document)
+            else:
+                if not delta_publish:
+                    streamed_upload(lambda fp: three_js_exporter.export(export_scene(scene), fp, buffer_writer))
+                else:
+                    # The patch needs the whole document
+                    document = three_js_exporter.build_document(export_scene(scene), buffer_writer)
+                    PublishSceneTask.delta_upload(p, url, manifests, api_root, scene_id, document, upload_document)
 
             msg = (TASK_DONE, None)
             queue_to_main.put(msg)
@@ -445,35 +820,183 @@ class PublishSceneTask(Task):
             msg = (TASK_ERROR, sys.exc_info())
             queue_to_main.put(msg)
 
-    def tick(self, context):
-        while not self.queue_to_main.empty():
-            msg, data = self.queue_to_main.get()
+    @staticmethod
+    def export_objects(scene, geometries, check_cancel, queue_to_main):
+        """
+        Yield the meshes of a snapshot with their geometry built, reporting
+        the export progress.
+        """
+        meshes = geometries.resolve_all(scene.objects)
+        for i, mesh in enumerate(meshes):
+            check_cancel()
+
+            data = ('export_progress', i / len(scene.objects))
+            msg = (TASK_UPDATE, data)
+            queue_to_main.put(msg)
 
-            if not self.is_finished:
-                if msg == RESPOND_CANCELED:
-                    self.canceled()
+            yield mesh
 
-                if msg == TASK_DONE:
-                    if self.on_done is not None:
-                        self.on_done()
-                    self.progress = 1
-                    self.done()
+        queue_to_main.put((TASK_UPDATE, ('export_progress', 1)))
 
-                if msg == TASK_UPDATE:
-                    request, data = data
+    @staticmethod
+    def pipelined_upload(p, url, write_scene, content_encoding, check_cancel, queue_to_main):
+        """
+        Write the scene with write_scene(fp) in a thread writing to an
+        upload.Pipe, while this thread uploads what is already written.
+        """
+        pipe = upload.Pipe()
+
+        def export():
+            try:
+                fp = pipe.text_writer()
+                write_scene(fp)
+                fp.flush()
+                pipe.close()
+            except Exception as e:
+                pipe.close(e)
+
+        def on_progress(read_so_far, size, sent_so_far):
+            check_cancel()
+
+            data = ('upload_progress', (read_so_far / pipe.written, read_so_far, sent_so_far))
+            msg = (TASK_UPDATE, data)
+            queue_to_main.put(msg)
 
-                    if request == 'progress':
-                        if self.notify_progress:
-                            self.last_progress_notify_date = time.time()
-                            self.progress = data
-                            self.notify()
+        thread = threading.Thread(target=export)
+        thread.start()
+        try:
+            upload.put_scene(p, url, pipe, on_progress, content_encoding=content_encoding)
+        except Exception:
+            # Report why the export stopped rather than the upload error
+            if pipe.error is not None:
+                raise pipe.error
+            raise
+        finally:
+            pipe.close_reader()
+            thread.join()
+
+    @staticmethod
+    def resumable_upload(p, url, uploads, api_root, scene_id, write_scene, check_cancel, queue_to_main):
+        """
+        Upload the scene written by write_scene(fp) with an
+        upload.ResumableUpload, writing its spool in another thread.
+        Without write_scene, resume the interrupted upload of the scene.
+
+        Returns False when the server does not support resumable uploads.
+        """
+        if write_scene is None:
+            resumable = upload.ResumableUpload.resume(p, uploads, api_root, scene_id)
+            if resumable is None:
+                raise RuntimeError('No interrupted upload of the scene to resume')
+        else:
+            resumable = upload.ResumableUpload.start(p, uploads, api_root, scene_id, url)
+            if resumable is None:
+                return False
+        spool = resumable.spool
+
+        def write():
+            try:
+                fp = spool.text_writer()
+                write_scene(fp)
+                fp.flush()
+                spool.close()
+            except Exception as e:
+                spool.close(e)
+
+        def on_progress(read_so_far, size, sent_so_far):
+            check_cancel()
+
+            # The size is known once the scene is written
+            if size is None:
+                data = ('upload_progress', (read_so_far / spool.uncompressed_written, read_so_far, sent_so_far))
+            else:
+                data = ('progress', (read_so_far / size, read_so_far, sent_so_far))
+            msg = (TASK_UPDATE, data)
+            queue_to_main.put(msg)
 
-                if msg == TASK_ERROR:
-                    exc_info = data
-                    self.set_error(exc_info)
+        thread = None
+        if write_scene is not None:
+            thread = threading.Thread(target=write)
+            thread.start()
+        try:
+            resumable.send(on_progress)
+        except Exception:
+            # Report why the export stopped rather than the upload error
+            if spool.error is not None:
+                raise spool.error
+            raise
+        finally:
+            spool.close_reader()
+            if thread is not None:
+                thread.join()
+        return True
 
-            self.queue_to_main.task_done()
+    @staticmethod
+    def write_copy(fp, export_path, write_scene):
+        """
+        Write the scene to fp with write_scene(fp), with a copy at
+        export_path when given.
+        """
+        if export_path is None:
+            write_scene(fp)
+        else:
+            with export_path.open('w') as copy_fp:
+                write_scene(upload.Tee(fp, copy_fp))
 
+    @staticmethod
+    def delta_upload(p, url, manifests, api_root, scene_id, document, upload_document):
+        manifest = delta.normalize(document)
+
+        base_manifest = manifests.load(api_root, scene_id)
+        if base_manifest is not None:
+            patch = delta.diff(base_manifest, manifest, document)
+            if delta.is_empty(patch) or delta.send_patch(p, url, patch):
+                manifests.save(api_root, scene_id, manifest)
+                return
+
+        # The server scene is unknown until the full upload succeeds
+        manifests.remove(api_root, scene_id)
+        upload_document(document)
+        manifests.save(api_root, scene_id, manifest)
+
+    def update(self, context, request, data):
+        if request == 'export_progress':
+            self.export_progress = data
+
+        # Fraction of the bytes exported so far
+        if request == 'upload_progress':
+            fraction, self.bytes_read, self.bytes_sent = data
+            self.upload_progress = fraction * (self.export_progress or 0)
+
+        if request == 'progress':
+            self.upload_progress, self.bytes_read, self.bytes_sent = data
+
+        if self.notify_progress:
+            self.last_progress_notify_date = time.time()
+            self.progress = self.upload_progress
+            if self.export_progress is not None:
+                self.progress = (self.export_progress + self.upload_progress) / 2
+            self.notify()
+
+    def handle(self, context, msg, data):
+        WorkerTask.handle(self, context, msg, data)
+
+        # Done, failed or canceled
+        if self.is_finished and self.on_finished is not None:
+            on_finished, self.on_finished = self.on_finished, None
+            on_finished(context)
+
+    def finish(self, context, data):
+        if self.bytes_read > 0:
+            print(self.upload_report())
+        if self.on_done is not None:
+            self.on_done()
+
+    def upload_report(self):
+        mask = 'Previz upload: {:.1f} MB sent for a {:.1f} MB scene ({:.0%})'
+        return mask.format(self.bytes_sent / 1024**2,
+                           self.bytes_read / 1024**2,
+                           self.bytes_sent / self.bytes_read)
 
     @property
     def notify_progress(self):
@@ -1,43 +1,86 @@
-import itertools
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
 import pathlib
+import runpy
+import sys
+import time
 
 import bpy
 import bpy_extras.io_utils
-import mathutils
+import numpy
 
 import previz
 
 from . import __name__ as generator
+# Precision and the PRECISION_* modes are also used through this module
+from .geometry_data import (
+    EncodedGeometry,
+    GeometryBuffers,
+    PRECISION_QUANTIZE,
+    PRECISION_ROUND,
+    Precision,
+    build_buffer_geometry_data,
+    build_geometry_data,
+    build_geometry_document,
+    encode_geometry,
+    encode_json
+)
 
 
 AXIS_CONVERSION = bpy_extras.io_utils.axis_conversion(to_forward='Z', to_up='Y').to_4x4()
 
+# Bump when the geometry data built from the same mesh changes,
+# as it invalidates the geometry cache entries
+EXPORTER_VERSION = 1
 
-class ThreeJSFaceBuilder(object):
-    def __init__(self, uvsets_count):
-        self.uvsets_count = uvsets_count
-        self.uv_indices = itertools.count()
+WORKER_INIT_PATH = pathlib.Path(__file__).parent / 'worker_init.py'
 
-    def __call__(self, face):
-        yield self.type(face)
-        yield face
 
-        uv_indices = [next(self.uv_indices) for i in range(len(face))]
-        for i in range(self.uvsets_count):
-            yield uv_indices
+# encoded_geometry is the EncodedGeometry of the meshes built by a GeometryPool
+Mesh = collections.namedtuple('Mesh',
+                              previz.Mesh._fields + ('geometry_key', 'encoded_geometry'),
+                              defaults=(None,))
 
 
-    def type(self, face):
-        """
-        See https://github.com/mrdoob/three.js/wiki/JSON-Model-format-3
-        """
-        has_uvsets = self.uvsets_count > 0
-        is_quad = len(face) == 4
-        return (int(is_quad) << 0) + (int(has_uvsets) << 3 )
+def read_array(collection, attribute, dtype, width=1):
+    ret = numpy.empty(len(collection)*width, dtype=dtype)
+    collection.foreach_get(attribute, ret)
+    if width > 1:
+        return ret.reshape(-1, width)
+    return ret
+
 
+def read_geometry_buffers(blender_geometry):
+    g = blender_geometry
 
-def build_uvset(uvset):
-    return previz.UVSet(uvset.name, (d.uv for d in uvset.data))
+    loop_totals = read_array(g.polygons, 'loop_total', numpy.int32)
+
+    # Only ngons need to be triangulated: use Blender loop triangles for them
+    triangle_loops = numpy.empty((0, 3), dtype=numpy.int32)
+    triangle_polygons = numpy.empty(0, dtype=numpy.int32)
+    if (loop_totals > 4).any():
+        g.calc_loop_triangles()
+        triangle_loops = read_array(g.loop_triangles, 'loops', numpy.int32, 3)
+        triangle_polygons = read_array(g.loop_triangles, 'polygon_index', numpy.int32)
+        is_ngon = loop_totals[triangle_polygons] > 4
+        triangle_loops = triangle_loops[is_ngon]
+        triangle_polygons = triangle_polygons[is_ngon]
+
+    return GeometryBuffers(
+        g.name,
+        read_array(g.vertices, 'co', numpy.float32, 3),
+        read_array(g.loops, 'vertex_index', numpy.int32),
+        read_array(g.polygons, 'loop_start', numpy.int32),
+        loop_totals,
+        triangle_loops,
+        triangle_polygons,
+        [(uvset.name, read_array(uvset.data, 'uv', numpy.float32, 2))
+         for uvset in g.uv_layers]
+    )
 
 
 def color2threejs(color):
@@ -51,56 +94,228 @@ def color2threejs(color):
     return 256*256*to_int(color.r) + 256*to_int(color.g) + to_int(color.b)
 
 
-def parse_mesh(blender_object):
+def world_matrix(blender_object):
+    return (AXIS_CONVERSION @ blender_object.matrix_world).transposed()
+
+
+def parse_mesh(blender_object, geometries, tracker=None):
     name = blender_object.name
-    world_matrix = (AXIS_CONVERSION @ blender_object.matrix_world).transposed()
-    
-    geometry_name, faces, vertices, uvsets = parse_geometry(blender_object.data)
-    
-    return previz.Mesh(name,
-                       geometry_name,
-                       world_matrix,
-                       faces,
-                       vertices,
-                       uvsets)
+
+    if tracker is None:
+        matrix = world_matrix(blender_object)
+    else:
+        matrix = tracker.world_matrix(blender_object)
+
+    geometry_key, geometry = geometries.parse(blender_object.data)
+    geometry_name, faces, vertices, uvsets = geometry
+
+    return Mesh(name,
+                geometry_name,
+                matrix,
+                faces,
+                vertices,
+                uvsets,
+                geometry_key,
+                geometries.pending.pop(geometry_key, None))
+
 
 def parse_geometry(blender_geometry):
-    g = blender_geometry
-    # All face geometry in 2.8 is defined as loop triangles
-    g.calc_loop_triangles()
-
-    # Count the vertices in our geom, and figure out how many uv sets we need to keep three happy
-    vertices = (v.co for v in g.vertices)
-    vertices_count = len(g.vertices)
-    uvsets_count = len(g.uv_layers)
-    uvsets = list(build_uvset(uvset) for uvset in g.uv_layers)
-
-    # Set our base builder with the uv sets to build
-    three_js_face = ThreeJSFaceBuilder(uvsets_count)
-
-    # This gets dark
-    # We need to loop over the triangles of the faces,
-    # BUT the way we handle uv mapping internally in the dag relies on 
-    # all the faces being defined as quads 
-    # So we'll first want to convert these triangles into Quads 
-    # Consequtive triangles in the set are paired, and can be merged into a single quad
-    # We loop through the triangles in sets of 2, then get the unqiue vertex points from the 
-    # 6 points (a[0], a[1], a[2] + b[0], b[1], b[2]) to turn into q[0],q[1],q[2],q[3]
-    # Then pass that quad over to the three_js_face logic to turn it into the format threejs wants
-    faces = []
-    iterable = iter(g.loop_triangles)
-    for item in iterable:
-        # Get the triangles 2 at a time 
-        first =  list(item.vertices)
-        second = list(next(iterable).vertices)
-
-        # Take all the vertexes in the first, then only the unique point from the second
-        quadface = first + [vertex for vertex in second if vertex not in first]
-
-        # Convert this quad for the threejs format, and append to our faces array
-        faces.extend(three_js_face(quadface))
-
-    return g.name, faces, vertices, uvsets
+    return build_geometry_data(read_geometry_buffers(blender_geometry))
+
+
+def id_key(id):
+    return id.as_pointer(), id.name
+
+
+def hash_geometry_buffers(buffers, precision=None, weld_uvs=False):
+    h = hashlib.sha1(str(EXPORTER_VERSION).encode('utf-8'))
+    h.update(repr(tuple(precision) if precision is not None else None).encode('utf-8'))
+    h.update(repr(weld_uvs).encode('utf-8'))
+    arrays = (buffers.vertices,
+              buffers.loop_vertices,
+              buffers.polygon_loop_starts,
+              buffers.polygon_loop_totals,
+              buffers.ngon_triangle_loops)
+    for array in arrays:
+        h.update(numpy.ascontiguousarray(array).data)
+    for name, uvs in buffers.uvsets:
+        h.update(name.encode('utf-8'))
+        h.update(numpy.ascontiguousarray(uvs).data)
+    return h.hexdigest()
+
+
+class Geometries(object):
+    """
+    Parse each geometry once per export.
+
+    Geometries are keyed by mesh datablock, so linked duplicates share their
+    geometry. With share_identical, meshes with identical buffers share their
+    geometry too. When a cache.GeometryCache is given, unchanged geometries
+    are loaded from it instead of being built again.
+
+    Only the first parse of a geometry returns its faces, vertices and UVs;
+    later ones only return its name and UV set names, so geometries are not
+    kept in memory once written.
+
+    reused maps datablock keys to the (key, content key) pairs of a previous
+    export that are still valid. Their geometry is loaded from the cache
+    without reading the mesh.
+
+    With buffer_geometry, geometries are built as BufferGeometry arrays
+    (see build_buffer_geometry_data) for export with a buffer writer. They
+    come straight from the mesh buffers, so the cache is not used.
+
+    precision is the Precision of vertices and UVs, None for full precision.
+    With weld_uvs, identical UV coordinates are written once per UV set.
+
+    With a GeometryPool, JSON geometries are built and encoded by its worker
+    processes. Their parse only returns their header, and the future of
+    their EncodedGeometry is kept in pending until the mesh takes it. With a
+    DeferredPool, they are only built when resolved. Geometries with the
+    same content key are submitted once, and share the same future.
+    """
+    def __init__(self,
+                 share_identical=False,
+                 cache=None,
+                 reused=None,
+                 buffer_geometry=False,
+                 precision=None,
+                 weld_uvs=False,
+                 pool=None):
+        self.share_identical = share_identical
+        self.precision = precision
+        self.weld_uvs = weld_uvs
+        self.buffer_geometry = buffer_geometry
+        self.cache = cache if not buffer_geometry else None
+        self.pool = pool if not buffer_geometry else None
+        self.reused = reused if reused is not None else {}
+        self.datablock_keys = {}
+        self.content_keys = {}
+        self.headers = {}
+        self.pending = {}
+        self.submitted = {}
+
+    def parse(self, blender_geometry):
+        datablock_key = id_key(blender_geometry)
+        key = self.datablock_keys.get(datablock_key)
+        if key is not None:
+            return key, self.headers[key]
+
+        geometry = None
+        if self.cache is not None and datablock_key in self.reused:
+            key, content_key = self.reused[datablock_key]
+            if key not in self.headers:
+                geometry = self.load(blender_geometry.name, content_key)
+
+        if geometry is None:
+            buffers = read_geometry_buffers(blender_geometry)
+            key = datablock_key
+            content_key = None
+            if self.share_identical or self.cache is not None:
+                content_key = hash_geometry_buffers(buffers, self.precision, self.weld_uvs)
+            if self.share_identical:
+                key = content_key
+            if key not in self.headers:
+                if self.pool is not None:
+                    geometry = self.submit(key, buffers, content_key)
+                else:
+                    geometry = self.build(buffers, content_key)
+
+        self.datablock_keys[datablock_key] = key
+        if geometry is None:
+            return key, self.headers[key]
+
+        name, faces, vertices, uvsets = geometry
+        self.content_keys[key] = content_key
+        self.headers[key] = (name,
+                             None,
+                             None,
+                             [previz.UVSet(uvset.name, None) for uvset in uvsets])
+        return key, geometry
+
+    def load(self, name, content_key):
+        cached = self.cache.get(content_key)
+        if cached is None:
+            return None
+        faces, vertices, uvsets = cached
+        uvsets = [previz.UVSet(uvset_name, coordinates) for uvset_name, coordinates in uvsets]
+        return name, faces, vertices, uvsets
+
+    def submit(self, key, buffers, content_key):
+        cache_path = None
+        if self.cache is not None:
+            geometry = self.load(buffers.name, content_key)
+            if geometry is not None:
+                return geometry
+            cache_path = str(self.cache.path(content_key))
+
+        future = self.submitted.get(content_key) if content_key is not None else None
+        if future is None:
+            future = self.pool.submit(encode_geometry,
+                                      generator,
+                                      buffers,
+                                      self.precision,
+                                      self.weld_uvs,
+                                      cache_path)
+            if content_key is not None:
+                self.submitted[content_key] = future
+        self.pending[key] = future
+        return (buffers.name,
+                None,
+                None,
+                [previz.UVSet(name, None) for name, uvs in buffers.uvsets])
+
+    def resolve(self, mesh):
+        """
+        Wait for the EncodedGeometry of a mesh built by the pool.
+        """
+        if mesh.encoded_geometry is None or isinstance(mesh.encoded_geometry, EncodedGeometry):
+            return mesh
+
+        encoded_geometry = mesh.encoded_geometry.result()
+        content_key = self.content_keys[mesh.geometry_key]
+        # Later meshes with this content load it from the cache, or wait on
+        # the future they already hold
+        self.submitted.pop(content_key, None)
+        if self.cache is not None:
+            self.cache.added(content_key)
+        return mesh._replace(encoded_geometry=encoded_geometry)
+
+    def resolve_all(self, meshes):
+        """
+        Yield meshes in order, with their geometry built by the pool.
+        """
+        if self.pool is None:
+            yield from meshes
+            return
+
+        # Keep reading the next meshes while the pool builds the geometries,
+        # and yield the meshes in order as their geometry is ready
+        pending = collections.deque()
+        for mesh in meshes:
+            if isinstance(mesh.encoded_geometry, DeferredJob):
+                mesh.encoded_geometry.start()
+            pending.append(mesh)
+            if len(pending) > 2*self.pool.workers:
+                yield self.resolve(pending.popleft())
+        while len(pending) > 0:
+            yield self.resolve(pending.popleft())
+
+    def build(self, buffers, content_key):
+        if self.buffer_geometry:
+            return build_buffer_geometry_data(buffers, self.precision)
+
+        if self.cache is None:
+            return build_geometry_data(buffers, self.precision, self.weld_uvs)
+
+        geometry = self.load(buffers.name, content_key)
+        if geometry is not None:
+            return geometry
+
+        t0 = time.time()
+        name, faces, vertices, uvsets = build_geometry_data(buffers, self.precision, self.weld_uvs)
+        self.cache.put(content_key, faces, vertices, uvsets, time.time() - t0)
+        return name, faces, vertices, uvsets
 
 
 def world_color(context):
@@ -113,13 +328,378 @@ def exportable_objects(context):
     return (o for o in context.visible_objects if o.type == 'MESH')
 
 
-def build_objects(context):
-    for o in exportable_objects(context):
-        yield parse_mesh(o)
+def build_objects(context, geometries=None, tracker=None):
+    if geometries is None:
+        geometries = Geometries()
+    meshes = (parse_mesh(o, geometries, tracker) for o in exportable_objects(context))
+    yield from geometries.resolve_all(meshes)
+
+
+def build_scene(context, geometries=None, tracker=None):
+    return previz.Scene(generator,
+                        pathlib.Path(bpy.data.filepath).name,
+                        world_color(context),
+                        build_objects(context, geometries, tracker))
+
+
+def snapshot_scene(context, geometries, tracker=None, objects=None):
+    """
+    Read the scene from Blender, to export it from another thread.
+
+    With a Geometries using a DeferredPool, only the mesh buffers of the JSON
+    geometries are read here. Export the snapshot with:
 
+        scene = snapshot_scene(context, geometries)
+        export(scene._replace(objects=geometries.resolve_all(scene.objects)), fp)
 
-def build_scene(context):
+    objects are the Blender objects to read, the exportable objects when None.
+    """
+    if objects is None:
+        objects = exportable_objects(context)
     return previz.Scene(generator,
                         pathlib.Path(bpy.data.filepath).name,
                         world_color(context),
-                        build_objects(context))
+                        [parse_mesh(o, geometries, tracker) for o in objects])
+
+
+class ChangeTracker(object):
+    """
+    Track the objects and meshes changed since the last successful export.
+
+    on_depsgraph_update is meant to be a depsgraph_update_post handler, and
+    on_frame_change a frame_change_post handler.
+    Objects that did not move since the last export reuse their world matrix.
+    Meshes left untouched are loaded from the geometry cache without being
+    read again.
+
+    The scene can change while an export reads it, between the time slices
+    of a SnapshotSceneTask. Changes made after begin are kept for the next
+    export.
+
+    Usage:
+        geometries = tracker.begin(share_identical, cache, buffer_geometry, precision)
+        export(build_scene(context, geometries, tracker), fp)
+        tracker.exported(geometries)
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.settings = None
+        self.matrices = {}
+        self.geometries = {}
+        self.new_matrices = {}
+        self.reused = {}
+        self.dirty_transforms = set()
+        self.dirty_geometries = set()
+        self.updated_transforms = set()
+        self.updated_geometries = set()
+
+    def on_depsgraph_update(self, scene, depsgraph):
+        for update in depsgraph.updates:
+            id = update.id.original
+            if isinstance(id, bpy.types.Object):
+                if update.is_updated_transform:
+                    self.transform_updated(id_key(id))
+                if update.is_updated_geometry and id.type == 'MESH':
+                    self.geometry_updated(id_key(id.data))
+            elif isinstance(id, bpy.types.Mesh):
+                if update.is_updated_geometry:
+                    self.geometry_updated(id_key(id))
+
+    def on_frame_change(self, scene, depsgraph=None):
+        # Frame changes do not run the depsgraph_update_post handlers, and
+        # animated objects move without a transform update
+        for object_key in set(self.matrices) | set(self.new_matrices):
+            self.transform_updated(object_key)
+
+    def transform_updated(self, object_key):
+        self.dirty_transforms.add(object_key)
+        self.updated_transforms.add(object_key)
+
+    def geometry_updated(self, datablock_key):
+        self.dirty_geometries.add(datablock_key)
+        self.updated_geometries.add(datablock_key)
+        # The running export must read it again if it did not yet
+        self.reused.pop(datablock_key, None)
+
+    def begin(self,
+              share_identical=False,
+              cache=None,
+              buffer_geometry=False,
+              precision=None,
+              weld_uvs=False,
+              pool=None):
+        # Geometry keys depend on these settings
+        settings = (share_identical, precision, weld_uvs)
+        if settings != self.settings:
+            self.clear()
+            self.settings = settings
+
+        self.new_matrices = {}
+        self.updated_transforms = set()
+        self.updated_geometries = set()
+        self.reused = dict((key, (geometry_key, content_key))
+                           for key, (geometry_key, content_key) in self.geometries.items()
+                           if key not in self.dirty_geometries and content_key is not None)
+        return Geometries(share_identical,
+                          cache,
+                          self.reused,
+                          buffer_geometry,
+                          precision,
+                          weld_uvs,
+                          pool)
+
+    def world_matrix(self, blender_object):
+        object_key = id_key(blender_object)
+        matrix = self.matrices.get(object_key)
+        if matrix is None or object_key in self.dirty_transforms:
+            matrix = world_matrix(blender_object)
+        self.new_matrices[object_key] = matrix
+        return matrix
+
+    def exported(self, geometries):
+        self.matrices = self.new_matrices
+        self.new_matrices = {}
+        self.geometries = dict(
+            (datablock_key, (key, geometries.content_keys[key]))
+            for datablock_key, key in geometries.datablock_keys.items()
+        )
+        self.reused = {}
+        self.dirty_transforms = self.updated_transforms
+        self.dirty_geometries = self.updated_geometries
+        self.updated_transforms = set()
+        self.updated_geometries = set()
+
+
+def build_geometry(scene, mesh):
+    return build_geometry_document(scene.generator,
+                                   mesh.geometry_name,
+                                   mesh.faces,
+                                   mesh.vertices,
+                                   mesh.uvsets)
+
+
+class GeometryPool(object):
+    """
+    Pool of worker processes building and encoding JSON geometries.
+
+    The mesh buffers are read on the main thread, where bpy can be used,
+    and sent to the workers. Use as a context manager, or call shutdown().
+    """
+    def __init__(self, workers):
+        self.workers = workers
+
+        context = multiprocessing.get_context('spawn')
+        # The Blender binary cannot run the worker processes. Blender 2.91
+        # removed binary_path_python, sys.executable is Python there.
+        context.set_executable(getattr(bpy.app, 'binary_path_python', sys.executable))
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            workers,
+            mp_context=context,
+            initializer=runpy.run_path,
+            initargs=(str(WORKER_INIT_PATH), {
+                'PACKAGE_NAME': generator,
+                'PACKAGE_PATH': str(WORKER_INIT_PATH.parent)
+            })
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+class DeferredPool(object):
+    """
+    Pool for snapshot_scene: the JSON geometries are built when resolved, by
+    the thread exporting the snapshot, or by pool when given.
+    """
+    def __init__(self, pool=None):
+        self.pool = pool
+        self.workers = pool.workers if pool is not None else 1
+
+    def submit(self, fn, *args):
+        return DeferredJob(self.pool, fn, args)
+
+
+class DeferredJob(object):
+    def __init__(self, pool, fn, args):
+        self.pool = pool
+        self.fn = fn
+        self.args = args
+        self.future = None
+
+    def start(self):
+        if self.pool is not None and self.future is None:
+            self.future = self.pool.submit(self.fn, *self.args)
+            self.args = None
+
+    def result(self):
+        if self.pool is None:
+            # Release the mesh buffers once built, the job may be shared by
+            # meshes with the same geometry content
+            if self.args is not None:
+                fn, args = self.fn, self.args
+                self.args = None
+                self.value = fn(*args)
+            return self.value
+
+        self.start()
+        return self.future.result()
+
+
+def uv_attribute_name(index):
+    # three.js names its UV attributes uv, uv2, uv3...
+    return 'uv' if index == 0 else 'uv{}'.format(index + 1)
+
+
+def build_buffer_geometry(scene, mesh, buffer_writer):
+    """
+    Build a three.js BufferGeometry for a mesh built with buffer_geometry.
+
+    Instead of an inline 'array', each attribute and the index have a
+    'buffer' entry returned by buffer_writer, referencing their packed
+    little endian values.
+    """
+    def attribute(array, item_size):
+        return {
+            'itemSize': item_size,
+            'type': 'Float32Array',
+            'normalized': False,
+            'buffer': buffer_writer(numpy.ascontiguousarray(array, dtype='<f4'))
+        }
+
+    attributes = {'position': attribute(mesh.vertices, 3)}
+    for i, uvset in enumerate(mesh.uvsets):
+        attributes[uv_attribute_name(i)] = attribute(uvset.coordinates, 2)
+
+    return {
+        'data': {
+            'attributes': attributes,
+            'index': {
+                'type': 'Uint32Array',
+                'buffer': buffer_writer(numpy.ascontiguousarray(mesh.faces, dtype='<u4'))
+            }
+        },
+        'name': mesh.geometry_name,
+        'uuid': previz.buildUuid(),
+        'type': 'BufferGeometry'
+    }
+
+
+class SidecarBufferWriter(object):
+    """
+    Buffer writer appending the buffers to a binary file object.
+
+    The buffers reference the file by uri, with their byteOffset and
+    byteLength in it.
+    """
+    def __init__(self, fp, uri):
+        self.fp = fp
+        self.uri = uri
+        self.offset = 0
+
+    def __call__(self, array):
+        data = array.tobytes()
+        self.fp.write(data)
+        ret = {
+            'uri': self.uri,
+            'byteOffset': self.offset,
+            'byteLength': len(data)
+        }
+        self.offset += len(data)
+        return ret
+
+
+def embedded_buffer_writer(array):
+    """
+    Buffer writer embedding the buffers as base64 data URIs.
+    """
+    data = base64.b64encode(array.tobytes()).decode('ascii')
+    return {'uri': 'data:application/octet-stream;base64,' + data}
+
+
+def export(scene, fp, buffer_writer=None):
+    """
+    Write scene to fp as a three.js JSON document.
+
+    The output is the same as json.dump(document, fp, indent=1, sort_keys=True)
+    but each geometry is written as soon as its object is built, so only one
+    geometry at a time is kept in memory. Objects sharing a geometry
+    reference a single entry in geometries.
+
+    When buffer_writer is given, the scene meshes must have been built with
+    buffer_geometry and are written as BufferGeometry.
+    """
+    def write_encoded(s, level):
+        fp.write(s.replace('\n', '\n' + ' '*level))
+
+    def write(value, level):
+        write_encoded(encode_json(value), level)
+
+    objects = []
+    geometry_uuids = {}
+
+    fp.write('{\n "animations": [],\n "geometries": [')
+    for mesh in scene.objects:
+        if mesh.geometry_key not in geometry_uuids:
+            if mesh.encoded_geometry is not None:
+                uuid, s = mesh.encoded_geometry
+            else:
+                if buffer_writer is None:
+                    geometry = build_geometry(scene, mesh)
+                else:
+                    geometry = build_buffer_geometry(scene, mesh, buffer_writer)
+                uuid, s = geometry['uuid'], encode_json(geometry)
+            fp.write(',\n  ' if len(geometry_uuids) > 0 else '\n  ')
+            write_encoded(s, 2)
+            geometry_uuids[mesh.geometry_key] = uuid
+        objects.append(previz.build_object(mesh, geometry_uuids[mesh.geometry_key]))
+    fp.write('\n ]' if len(geometry_uuids) > 0 else ']')
+
+    fp.write(',\n "images": [],\n "materials": [],\n "metadata": ')
+    write(previz.build_metadata(scene), 1)
+    fp.write(',\n "object": ')
+    write(previz.build_scene_root(scene, objects), 1)
+    fp.write(',\n "textures": []\n}')
+
+
+def build_document(scene, buffer_writer=None):
+    """
+    Build scene as the three.js JSON document export writes.
+
+    Unlike export, all the geometries are kept in memory, for the callers
+    that need the whole document.
+    """
+    geometries = []
+    geometry_uuids = {}
+    objects = []
+    for mesh in scene.objects:
+        if mesh.geometry_key not in geometry_uuids:
+            if mesh.encoded_geometry is not None:
+                geometry = json.loads(mesh.encoded_geometry.json)
+            elif buffer_writer is None:
+                geometry = build_geometry(scene, mesh)
+            else:
+                geometry = build_buffer_geometry(scene, mesh, buffer_writer)
+            geometries.append(geometry)
+            geometry_uuids[mesh.geometry_key] = geometry['uuid']
+        objects.append(previz.build_object(mesh, geometry_uuids[mesh.geometry_key]))
+
+    return {
+        'animations': [],
+        'geometries': geometries,
+        'images': [],
+        'materials': [],
+        'metadata': previz.build_metadata(scene),
+        'object': previz.build_scene_root(scene, objects),
+        'textures': []
+    }
@@ -0,0 +1,639 @@
+import collections
+import hashlib
+import io
+import json
+import os
+import pathlib
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CHUNK_SIZE = 64 * 1024
+PIPE_SIZE = 16 * CHUNK_SIZE
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+IDENTITY = 'identity'
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Response of a server not accepting the Content-Encoding of a request
+UNSUPPORTED_MEDIA_TYPE = 415
+
+RESUMABLE_CHUNK_SIZE = 4 * 1024 * 1024
+RETRIES = 5
+RETRY_DELAY = .5 # Doubled after each retry
+
+# Response to the chunks of a resumable upload but the last one
+RESUME_INCOMPLETE = 308
+
+# Responses of a server without resumable uploads. Servers unaware of the
+# uploads query answer it as a malformed request
+SESSIONS_UNSUPPORTED_STATUS_CODES = (400, 404, 405, 501)
+
+# Responses to the chunks of an expired upload session
+SESSION_EXPIRED_STATUS_CODES = (404, 410)
+
+
+class Pipe(object):
+    """
+    Bounded in-memory buffer between a thread writing a document and a
+    thread uploading it.
+
+    The writer gets a text file from text_writer() and blocks while more
+    than max_size bytes are waiting to be read. It ends the document with
+    close(), or with close(error) to make the reader raise error. The
+    reader reads bytes with read() and calls close_reader() when it stops
+    reading, so a blocked writer raises BrokenPipeError.
+    """
+    def __init__(self, max_size=PIPE_SIZE):
+        self.max_size = max_size
+
+        self.chunks = collections.deque()
+        self.size = 0
+        self.written = 0
+
+        self.is_closed = False
+        self.is_broken = False
+        self.error = None
+
+        self.condition = threading.Condition()
+
+    def text_writer(self):
+        raw = PipeWriter(self)
+        return io.TextIOWrapper(io.BufferedWriter(raw, CHUNK_SIZE), encoding='utf-8')
+
+    def write(self, data):
+        with self.condition:
+            while self.size >= self.max_size and not self.is_broken:
+                self.condition.wait()
+            if self.is_broken:
+                raise BrokenPipeError('The upload of the document stopped')
+            self.chunks.append(bytes(data))
+            self.size += len(data)
+            self.written += len(data)
+            self.condition.notify_all()
+        return len(data)
+
+    def close(self, error=None):
+        with self.condition:
+            self.is_closed = True
+            self.error = error
+            self.condition.notify_all()
+
+    def read(self, size=-1):
+        with self.condition:
+            while len(self.chunks) == 0 and not self.is_closed:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+
+            ret = bytearray()
+            while len(self.chunks) > 0 and (size < 0 or len(ret) < size):
+                chunk = self.chunks.popleft()
+                if size >= 0 and len(ret) + len(chunk) > size:
+                    remaining = size - len(ret)
+                    self.chunks.appendleft(chunk[remaining:])
+                    chunk = chunk[:remaining]
+                ret += chunk
+            self.size -= len(ret)
+            self.condition.notify_all()
+            return bytes(ret)
+
+    def close_reader(self):
+        with self.condition:
+            self.is_broken = True
+            self.chunks.clear()
+            self.size = 0
+            self.condition.notify_all()
+
+
+class PipeWriter(io.RawIOBase):
+    """
+    Raw file writing to a Pipe or a Spool. Closing it does not close the
+    pipe, so a document is only complete once Pipe.close() is called.
+    """
+    def __init__(self, pipe):
+        super().__init__()
+        self.pipe = pipe
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.pipe.write(b)
+
+
+class Tee(object):
+    """
+    Text file writing to several files, to keep a copy of an upload.
+    """
+    def __init__(self, *fps):
+        self.fps = fps
+
+    def write(self, s):
+        for fp in self.fps:
+            fp.write(s)
+        return len(s)
+
+    def flush(self):
+        for fp in self.fps:
+            fp.flush()
+
+
+class SizedBody(object):
+    """
+    Request body of chunks with a known size, sent with a Content-Length.
+    """
+    def __init__(self, chunks, size):
+        self.chunks = chunks
+        self.size = size
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __len__(self):
+        return self.size
+
+
+class IdentityCompressor(object):
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def compressor(content_encoding):
+    if content_encoding == GZIP:
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if content_encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return IdentityCompressor()
+
+
+def preferred_encodings():
+    """
+    Content encodings to use for uploads when the server accepts them, best
+    first.
+    """
+    ret = [GZIP, IDENTITY]
+    if zstandard is not None:
+        ret.insert(0, ZSTD)
+    return ret
+
+
+class EncodingRejected(Exception):
+    pass
+
+
+class ContentEncodings(object):
+    """
+    Content encodings accepted by each upload server, learned from their
+    responses.
+
+    Scenes are uploaded without compression until the server lists the
+    encodings it accepts in the Accept-Encoding header of a response
+    (RFC 7694). A server rejects an encoding with 415 Unsupported Media
+    Type.
+    """
+    def __init__(self):
+        self.accepted_encodings = {}
+        self.advertised_encodings = {}
+        self.rejected_encodings = {}
+        self.lock = threading.Lock()
+
+    def choose(self, url):
+        with self.lock:
+            origin = url_origin(url)
+            if origin in self.accepted_encodings:
+                return self.accepted_encodings[origin]
+            advertised = self.advertised_encodings.get(origin, set())
+            rejected = self.rejected_encodings.get(origin, set())
+            return [e for e in preferred_encodings()
+                    if e == IDENTITY or (e in advertised and e not in rejected)][0]
+
+    def accepted(self, url, content_encoding):
+        # Identity is always accepted, and would hide the encodings
+        # advertised later
+        if content_encoding == IDENTITY:
+            return
+        with self.lock:
+            self.accepted_encodings[url_origin(url)] = content_encoding
+
+    def advertised(self, url, response):
+        if 'Accept-Encoding' not in response.headers:
+            return
+        encodings = set(e.split(';')[0].strip() for e in response.headers['Accept-Encoding'].split(','))
+        with self.lock:
+            self.advertised_encodings[url_origin(url)] = encodings
+
+    def rejected(self, url, content_encoding, response):
+        self.advertised(url, response)
+        with self.lock:
+            origin = url_origin(url)
+            self.rejected_encodings.setdefault(origin, set()).add(content_encoding)
+            if self.accepted_encodings.get(origin) == content_encoding:
+                del self.accepted_encodings[origin]
+
+
+def url_origin(url):
+    u = urllib.parse.urlsplit(url)
+    return u.scheme, u.netloc
+
+
+content_encodings = ContentEncodings()
+
+
+def put_scene(project, json_url, fp, progress_callback=None, size=None, content_encoding=IDENTITY):
+    """
+    Upload the scene JSON read from the binary file fp to json_url.
+
+    fp is read in chunks, compressed with content_encoding, while they are
+    sent. Compressed scenes and scenes without a size are sent with a
+    chunked transfer encoding, so fp can be a Pipe still being written.
+    progress_callback gets the bytes read so far, size and the bytes sent
+    so far after each chunk is read.
+
+    Raises EncodingRejected when the server does not accept
+    content_encoding, which is then recorded in content_encodings.
+    """
+    def chunks():
+        c = compressor(content_encoding)
+        read_so_far = 0
+        sent_so_far = 0
+        while True:
+            data = fp.read(CHUNK_SIZE)
+            if len(data) == 0:
+                break
+            read_so_far += len(data)
+            data = c.compress(data)
+            sent_so_far += len(data)
+            if progress_callback is not None:
+                progress_callback(read_so_far, size, sent_so_far)
+            # An empty chunk would end a chunked body
+            if len(data) > 0:
+                yield data
+        data = c.flush()
+        if len(data) > 0:
+            sent_so_far += len(data)
+            if progress_callback is not None:
+                progress_callback(read_so_far, size, sent_so_far)
+            yield data
+
+    headers = {'Content-Type': 'application/json'}
+    if content_encoding != IDENTITY:
+        headers['Content-Encoding'] = content_encoding
+        size_sent = None
+    else:
+        size_sent = size
+
+    body = chunks() if size_sent is None else SizedBody(chunks(), size_sent)
+    r = project.request('PUT',
+                        json_url,
+                        data=body,
+                        headers=headers)
+    if r.status_code == UNSUPPORTED_MEDIA_TYPE and content_encoding != IDENTITY:
+        content_encodings.rejected(json_url, content_encoding, r)
+        raise EncodingRejected(content_encoding)
+    r.raise_for_status()
+    content_encodings.accepted(json_url, content_encoding)
+    content_encodings.advertised(json_url, r)
+
+
+def upload_scene(project, json_url, open_scene, progress_callback=None, size=None):
+    """
+    Upload the scene with the best content encoding accepted by the server
+    of json_url, trying the next ones when it is rejected.
+
+    open_scene() returns a new binary file of the scene, closed once
+    uploaded. Returns the content encoding used.
+    """
+    while True:
+        content_encoding = content_encodings.choose(json_url)
+        try:
+            with open_scene() as fp:
+                put_scene(project, json_url, fp, progress_callback, size, content_encoding)
+            return content_encoding
+        except EncodingRejected:
+            pass
+
+
+class UploadServerError(Exception):
+    pass
+
+
+class SessionExpired(Exception):
+    pass
+
+
+# Errors after which a chunk is sent again
+RETRIED_ERRORS = (requests.ConnectionError, requests.Timeout, UploadServerError)
+
+
+class Spool(object):
+    """
+    Scene file on disk, written by one thread while another uploads it.
+
+    Like a Pipe, the writer gets a text file from text_writer() and ends
+    the scene with close() or close(error). The scene is compressed with
+    content_encoding as written, so a resumed upload sends the same bytes.
+    read(offset, size) blocks until the bytes are written.
+    """
+    def __init__(self, path, content_encoding=IDENTITY):
+        self.path = pathlib.Path(path)
+        self.compressor = compressor(content_encoding)
+        self.fp = None
+
+        self.written = 0
+        self.uncompressed_written = 0
+
+        self.is_closed = False
+        self.is_broken = False
+        self.error = None
+
+        self.condition = threading.Condition()
+
+    @classmethod
+    def complete(cls, path, uncompressed_size):
+        """
+        Spool of a scene written before.
+        """
+        spool = cls(path)
+        spool.written = spool.path.stat().st_size
+        spool.uncompressed_written = uncompressed_size
+        spool.is_closed = True
+        return spool
+
+    def text_writer(self):
+        self.fp = self.path.open('wb')
+        raw = PipeWriter(self)
+        return io.TextIOWrapper(io.BufferedWriter(raw, CHUNK_SIZE), encoding='utf-8')
+
+    def write(self, data):
+        if self.is_broken:
+            raise BrokenPipeError('The upload of the document stopped')
+        compressed = self.compressor.compress(bytes(data))
+        self.fp.write(compressed)
+        self.fp.flush()
+        with self.condition:
+            self.written += len(compressed)
+            self.uncompressed_written += len(data)
+            self.condition.notify_all()
+        return len(data)
+
+    def close(self, error=None):
+        data = b''
+        if self.fp is not None:
+            if error is None:
+                data = self.compressor.flush()
+                self.fp.write(data)
+            self.fp.close()
+        with self.condition:
+            self.written += len(data)
+            self.is_closed = True
+            self.error = error
+            self.condition.notify_all()
+
+    def read(self, offset, size):
+        with self.condition:
+            while self.written < offset + size and not self.is_closed:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+        with self.path.open('rb') as fp:
+            fp.seek(offset)
+            return fp.read(size)
+
+    def close_reader(self):
+        self.is_broken = True
+
+
+class UploadStore(object):
+    """
+    States of the resumable uploads of each scene, as JSON files in
+    directory next to their spool files.
+    """
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+
+    def load(self, api_root, scene_id):
+        try:
+            with self.path(api_root, scene_id).open() as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, api_root, scene_id, state):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(api_root, scene_id)
+        tmp_path = path.with_suffix('.tmp')
+        with tmp_path.open('w') as fp:
+            json.dump(state, fp)
+        os.replace(str(tmp_path), str(path))
+
+    def remove(self, api_root, scene_id):
+        for path in (self.path(api_root, scene_id), self.spool_path(api_root, scene_id)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def can_resume(self, api_root, scene_id):
+        """
+        Is there an interrupted upload of scene_id with a complete spool?
+        """
+        state = self.load(api_root, scene_id)
+        if state is None or state['size'] is None:
+            return False
+        try:
+            return self.spool_path(api_root, scene_id).stat().st_size == state['size']
+        except OSError:
+            return False
+
+    def key(self, api_root, scene_id):
+        return hashlib.sha1((api_root + '\n' + scene_id).encode('utf-8')).hexdigest()
+
+    def path(self, api_root, scene_id):
+        return self.directory / (self.key(api_root, scene_id) + '.json')
+
+    def spool_path(self, api_root, scene_id):
+        return self.directory / (self.key(api_root, scene_id) + '.spool')
+
+
+class ResumableUpload(object):
+    """
+    Upload of a scene in chunks to an upload session, resumed from the last
+    offset acknowledged by the server when interrupted.
+
+    A session is started with a POST to the scene JSON URL with ?uploads,
+    answered with 201 Created and the session URL in Location. The chunks
+    are sent to it with PUT and a Content-Range, and answered with 308
+    Resume Incomplete and the bytes received so far in Range until the
+    scene is complete. A PUT without body and a Content-Range of
+    bytes */size asks for the bytes received.
+
+    A chunk failing on a network or server error is sent again up to
+    retries times, retry_delay seconds later, doubled after each retry. The
+    state is saved in an UploadStore after each chunk, so the upload can be
+    resumed after a restart.
+    """
+    def __init__(self,
+                 project,
+                 store,
+                 api_root,
+                 scene_id,
+                 state,
+                 spool,
+                 chunk_size=None,
+                 retries=None,
+                 retry_delay=None):
+        self.project = project
+        self.store = store
+        self.api_root = api_root
+        self.scene_id = scene_id
+        self.state = state
+        self.spool = spool
+        self.chunk_size = chunk_size if chunk_size is not None else RESUMABLE_CHUNK_SIZE
+        self.retries = retries if retries is not None else RETRIES
+        self.retry_delay = retry_delay if retry_delay is not None else RETRY_DELAY
+
+    @classmethod
+    def start(cls, project, store, api_root, scene_id, json_url, **kwargs):
+        """
+        Start an upload session for the scene, to be written to the spool.
+        Returns None when the server does not support resumable uploads.
+        """
+        while True:
+            content_encoding = content_encodings.choose(json_url)
+            r = project.request('POST',
+                                json_url,
+                                params={'uploads': ''},
+                                headers={'X-Upload-Content-Type': 'application/json',
+                                         'X-Upload-Content-Encoding': content_encoding})
+            if r.status_code == UNSUPPORTED_MEDIA_TYPE and content_encoding != IDENTITY:
+                content_encodings.rejected(json_url, content_encoding, r)
+                continue
+            if r.status_code in SESSIONS_UNSUPPORTED_STATUS_CODES:
+                return None
+            r.raise_for_status()
+            content_encodings.advertised(json_url, r)
+            break
+
+        state = {
+            'json_url': json_url,
+            'session_url': urllib.parse.urljoin(json_url, r.headers['Location']),
+            'content_encoding': content_encoding,
+            'offset': 0,
+            'size': None,
+            'uncompressed_size': None
+        }
+        store.remove(api_root, scene_id)
+        store.save(api_root, scene_id, state)
+        spool = Spool(store.spool_path(api_root, scene_id), content_encoding)
+        return cls(project, store, api_root, scene_id, state, spool, **kwargs)
+
+    @classmethod
+    def resume(cls, project, store, api_root, scene_id, **kwargs):
+        """
+        Resume the interrupted upload of the scene. Returns None when there
+        is none.
+        """
+        if not store.can_resume(api_root, scene_id):
+            return None
+        state = store.load(api_root, scene_id)
+        spool = Spool.complete(store.spool_path(api_root, scene_id), state['uncompressed_size'])
+        return cls(project, store, api_root, scene_id, state, spool, **kwargs)
+
+    def send(self, progress_callback=None):
+        """
+        Send the spool as it is written. progress_callback gets the
+        uncompressed bytes sent so far, the uncompressed size once known
+        and the bytes sent so far.
+        """
+        # Ask the server what it received before resuming
+        offset = self.state['offset'] if self.state['offset'] == 0 else None
+        failures = 0
+        while True:
+            # The spool can be resumed once complete
+            if self.spool.is_closed and self.spool.error is None and self.state['size'] is None:
+                self.state['size'] = self.spool.written
+                self.state['uncompressed_size'] = self.spool.uncompressed_written
+                self.store.save(self.api_root, self.scene_id, self.state)
+
+            try:
+                if offset is None:
+                    offset, is_complete = self.query_offset()
+                else:
+                    chunk = self.spool.read(offset, self.chunk_size)
+                    size = self.spool.written if self.spool.is_closed else None
+                    offset, is_complete = self.put_chunk(offset, chunk, size)
+                failures = 0
+            except RETRIED_ERRORS:
+                failures += 1
+                if failures > self.retries:
+                    raise
+                time.sleep(self.retry_delay * 2**(failures - 1))
+                offset = None
+                continue
+            except SessionExpired:
+                self.store.remove(self.api_root, self.scene_id)
+                raise
+
+            if is_complete:
+                self.store.remove(self.api_root, self.scene_id)
+                return
+
+            self.state['offset'] = offset
+            self.store.save(self.api_root, self.scene_id, self.state)
+
+            if progress_callback is not None and self.spool.written > 0:
+                read_so_far = offset * self.spool.uncompressed_written // self.spool.written
+                size = self.spool.uncompressed_written if self.spool.is_closed else None
+                progress_callback(read_so_far, size, offset)
+
+    def put_chunk(self, offset, chunk, size):
+        total = '*' if size is None else str(size)
+        if len(chunk) == 0:
+            content_range = 'bytes */' + total
+        else:
+            content_range = 'bytes {}-{}/{}'.format(offset, offset + len(chunk) - 1, total)
+        r = self.project.request('PUT',
+                                 self.state['session_url'],
+                                 data=chunk,
+                                 headers={'Content-Range': content_range},
+                                 allow_redirects=False)
+        return self.parse_response(r)
+
+    def query_offset(self):
+        size = self.spool.written if self.spool.is_closed else None
+        return self.put_chunk(0, b'', size)
+
+    @staticmethod
+    def parse_response(r):
+        """
+        Returns the bytes received by the server and if the upload is
+        complete.
+        """
+        if r.status_code in (200, 201):
+            return None, True
+        if r.status_code == RESUME_INCOMPLETE:
+            if 'Range' not in r.headers:
+                return 0, False
+            return int(r.headers['Range'].split('-')[-1]) + 1, False
+        if r.status_code in SESSION_EXPIRED_STATUS_CODES:
+            raise SessionExpired(r.status_code)
+        if r.status_code >= 500:
+            raise UploadServerError(r.status_code)
+        r.raise_for_status()
+        raise UploadServerError(r.status_code)
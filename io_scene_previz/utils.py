@@ -1,15 +1,50 @@
+import collections
+
+
+LAZY_TREE_CACHE_SIZE = 32
+NO_ITEMS = ()
+
+
 class Active(object):
+    """
+    Teams, projects and scenes, and the ones selected in the scene.
+
+    In lazy tree mode, load_children is set to a function getting the
+    'projects' of a team or the 'scenes' of a project, and the lists are
+    None until loaded with set_children. At most lazy_cache_size lists are
+    kept, the least recently selected ones are set back to None.
+
+    Lookups by id and menu items use indexes built once per list, dropped
+    when teams is set or a list is loaded.
+    """
     default_team = '[Need to refresh]'
     default_name = 'Select'
     default_id = 'empty_id'
 
-    def __init__(self):
+    def __init__(self, lazy_cache_size=LAZY_TREE_CACHE_SIZE):
         self.teams = [] # Structure teams.projects.scenes
+        self.teams_hash = None
+
+        self.load_children = None # f(context, item, name)
+        self.lazy_cache_size = lazy_cache_size
+        self.loaded = collections.OrderedDict() # (name, id) -> None, in use order
+
+        self.indexes = {} # id(items) -> (items, {id: item}, {default name: menu items})
+        self.indexed_teams = None
 
     @property
     def is_refreshed(self):
         return len(self.teams) > 0
 
+    def update_teams(self, teams, teams_hash):
+        """Set teams, unless they have the hash of the current ones"""
+        if teams_hash is not None and teams_hash == self.teams_hash:
+            return False
+        self.teams = teams
+        self.teams_hash = teams_hash
+        self.loaded.clear()
+        return True
+
     def is_valid(self, context):
         return self.scene(context) is not None
 
@@ -23,7 +58,7 @@ class Active(object):
 
     def team_menu_items(self):
         def cb(other, context):
-            return self.menu_items(self.teams, '[No team]')
+            return self.cached_menu_items(self.teams, '[No team]')
         return cb
 
     def team_menu_update(self):
@@ -31,6 +66,7 @@ class Active(object):
             projects = self.projects(context)
             project = projects[0] if len(projects) > 0 else None
             self.set_project(context, project)
+            self.ensure_loaded(context)
             self.log(context)
         return cb
 
@@ -39,8 +75,8 @@ class Active(object):
     def projects(self, context):
         team = self.team(context)
         if not team:
-            return []
-        return team.get('projects')
+            return NO_ITEMS
+        return team.get('projects') or NO_ITEMS
 
     def project(self, context):
         return self.getitem(
@@ -54,7 +90,7 @@ class Active(object):
 
     def project_menu_items(self):
         def cb(other, context):
-            return self.menu_items(self.projects(context), '[No project]')
+            return self.cached_menu_items(self.projects(context), '[No project]')
         return cb
 
     def project_menu_update(self):
@@ -62,6 +98,7 @@ class Active(object):
             scenes = self.scenes(context)
             scene = scenes[0] if len(scenes) > 0 else None
             self.set_scene(context, scene)
+            self.ensure_loaded(context)
             self.log(context)
         return cb
 
@@ -70,8 +107,8 @@ class Active(object):
     def scenes(self, context):
         project = self.project(context)
         if not project:
-            return []
-        return project.get('scenes')
+            return NO_ITEMS
+        return project.get('scenes') or NO_ITEMS
 
     def scene(self, context):
         return self.getitem(
@@ -85,7 +122,7 @@ class Active(object):
 
     def scene_menu_items(self):
         def cb(other, context):
-            return self.menu_items(self.scenes(context), '[No scene]')
+            return self.cached_menu_items(self.scenes(context), '[No scene]')
         return cb
 
     def scene_menu_update(self):
@@ -93,6 +130,60 @@ class Active(object):
             self.log(context)
         return cb
 
+    # Lazy tree
+
+    def ensure_loaded(self, context):
+        """
+        Load the projects of the active team, or the scenes of the active
+        project, when they are not loaded yet.
+        """
+        for item, name in ((self.team(context), 'projects'),
+                           (self.project(context), 'scenes')):
+            if item is None:
+                return
+            if item.get(name) is None:
+                if self.load_children is not None:
+                    self.load_children(context, item, name)
+                return
+            key = (name, item['id'])
+            if key in self.loaded:
+                self.loaded.move_to_end(key)
+
+    def set_children(self, context, name, item_id, children):
+        """
+        Set the loaded projects of a team or scenes of a project, and select
+        the first ones if none is.
+        """
+        item = self.find_parent(name, item_id)
+        if item is None:
+            return
+
+        item[name] = children
+        self.indexes.clear()
+        self.loaded[(name, item_id)] = None
+        while len(self.loaded) > self.lazy_cache_size:
+            (old_name, old_id), _ = self.loaded.popitem(last=False)
+            old_item = self.find_parent(old_name, old_id)
+            if old_item is not None:
+                old_item[old_name] = None
+
+        if self.project(context) is None:
+            projects = self.projects(context)
+            self.set_project(context, projects[0] if len(projects) > 0 else None)
+        if self.scene(context) is None:
+            scenes = self.scenes(context)
+            self.set_scene(context, scenes[0] if len(scenes) > 0 else None)
+        self.ensure_loaded(context)
+
+    def find_parent(self, name, item_id):
+        if name == 'projects':
+            return self.getitem(self.teams, item_id)
+        for team in self.teams:
+            project = self.getitem(team.get('projects') or NO_ITEMS, item_id)
+            if project is not None:
+                return project
+        return None
+
     # utils
 
     def log(self, context):
@@ -103,12 +194,26 @@ class Active(object):
             )
         )
 
-    @staticmethod
-    def getitem(items, id, default=None):
-        for item in items:
-            if item['id'] == id:
-                return item
-        return default
+    def index(self, items):
+        if self.indexed_teams is not self.teams:
+            self.indexes.clear()
+            self.indexed_teams = self.teams
+        entry = self.indexes.get(id(items))
+        if entry is None:
+            # Keeping items in the entry keeps its id from being reused
+            entry = (items, {item['id']: item for item in items}, {})
+            self.indexes[id(items)] = entry
+        return entry
+
+    def getitem(self, items, id, default=None):
+        return self.index(items)[1].get(id, default)
+
+    def cached_menu_items(self, items, default_item_name):
+        # Blender also needs the strings of the items to be kept alive
+        menu_items = self.index(items)[2]
+        if default_item_name not in menu_items:
+            menu_items[default_item_name] = self.menu_items(items, default_item_name)
+        return menu_items[default_item_name]
 
     @staticmethod
     def contains(items, id):
@@ -166,6 +271,29 @@ def extract(data, next_name = None):
     return ret, ret[next_name]
 
 
+def extract_teams(teams_data):
+    """Teams with projects to load, see Active.set_children"""
+    teams = []
+    for t in teams_data:
+        team = extract(t)
+        team['projects'] = None
+        teams.append(team)
+    return teams
+
+
+def extract_projects(team_data):
+    projects = []
+    for p in team_data['projects']:
+        project = extract(p)
+        project['scenes'] = None
+        projects.append(project)
+    return projects
+
+
+def extract_scenes(project_data):
+    return [extract(s) for s in project_data['scenes']]
+
+
 def extract_all(teams_data):
     teams = []
     for t in teams_data:
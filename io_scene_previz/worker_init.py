@@ -0,0 +1,12 @@
+# Geometry worker processes initializer, run with runpy.run_path.
+#
+# The add-on package imports bpy, which only exists in Blender. Register an
+# empty package in its place, so the worker processes can import the
+# modules of the package that do not depend on bpy.
+
+import sys
+import types
+
+package = types.ModuleType(PACKAGE_NAME)
+package.__path__ = [PACKAGE_PATH]
+sys.modules[PACKAGE_NAME] = package
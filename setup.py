@@ -26,7 +26,7 @@ setup(
     keywords='previz 3d scene exporter',
     packages=find_packages(exclude=['tools.distutils.command', 'tests']),
     install_requires=['previz', 'pyperclip', 'requests_toolbelt', 'semantic_version'],
-    extras_require={},
+    extras_require={'zstd': ['zstandard']},
     package_data={},
     data_files=[],
     cmdclass={
@@ -0,0 +1,267 @@
+import gzip
+import hashlib
+import http.server
+import json
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class StandInServer(object):
+    """
+    Local stand-in for the Previz API and its scene storage.
+
+    Serves the teams and scene endpoints and stores the scene JSON uploaded
+    with PUT. The teams are sent with an ETag, and answered with 304 Not
+    Modified when it matches If-None-Match.
+    PATCH requests are applied to the stored scene when accept_patches is
+    True, and answered with 405 Method Not Allowed otherwise.
+
+    Scenes compressed with a Content-Encoding in content_encodings are
+    decompressed, other encodings are answered with 415 Unsupported Media
+    Type, and moved from requests to rejected_requests. content_encodings
+    are listed in the Accept-Encoding header of the upload responses. The
+    recorded requests keep the bodies as sent.
+
+    With resumable, scenes can be uploaded in chunks to upload sessions,
+    see upload.ResumableUpload. faults lists what goes wrong with the next
+    requests to the sessions: None for nothing, 'error' to answer 503
+    Service Unavailable and drop the chunk, and 'disconnect' to keep the
+    chunk and close the connection without answering.
+    """
+    def __init__(self,
+                 accept_patches=True,
+                 content_encodings=('gzip', 'zstd'),
+                 resumable=True,
+                 faults=()):
+        self.accept_patches = accept_patches
+        self.content_encodings = content_encodings
+        self.resumable = resumable
+        self.faults = list(faults)
+        self.requests = []
+        self.rejected_requests = []
+        self.sessions = {}
+        self.teams = []
+        self.scene = None
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            # Keep the connections alive
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.handle(self, 'GET')
+
+            def do_POST(self):
+                server.handle(self, 'POST')
+
+            def do_PUT(self):
+                server.handle(self, 'PUT')
+
+            def do_PATCH(self):
+                server.handle(self, 'PATCH')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def api_root(self):
+        return self.url + '/api'
+
+    @property
+    def scene_json_url(self):
+        return self.url + '/scene.json'
+
+    def handle(self, handler, method):
+        body = b''
+        if 'Content-Length' in handler.headers:
+            body = handler.rfile.read(int(handler.headers['Content-Length']))
+        elif handler.headers.get('Transfer-Encoding') == 'chunked':
+            body = read_chunked(handler.rfile)
+            if body is None:
+                # The client stopped sending
+                handler.close_connection = True
+                return
+        self.requests.append((method, handler.path, handler.headers, body))
+
+        if method == 'GET' and handler.path.split('?')[0] == '/api/teams':
+            data = {'data': [{'data': team} for team in self.teams]}
+            etag = '"{}"'.format(hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest())
+            if handler.headers.get('If-None-Match') == etag:
+                self.respond(handler, 304, headers={'ETag': etag})
+            else:
+                self.respond(handler, 200, data, headers={'ETag': etag})
+            return
+
+        if method == 'GET' and handler.path.startswith('/api/scenes/'):
+            scene_id = handler.path.split('?')[0].split('/')[-1]
+            self.respond(handler, 200, {
+                'data': [{
+                    'data': {'id': scene_id},
+                    'links': [{'rel': 'scene.json', 'url': self.scene_json_url}]
+                }]
+            })
+            return
+
+        if method == 'PUT' and handler.path == '/scene.json':
+            content_encoding = handler.headers.get('Content-Encoding', 'identity')
+            if not self.accepts(handler, content_encoding):
+                return
+            self.store_scene(body, content_encoding)
+            self.respond(handler, 200, headers=self.accept_encoding_headers())
+            return
+
+        if method == 'POST' and handler.path.split('?')[0] == '/scene.json':
+            if not self.resumable or '?uploads' not in handler.path:
+                self.respond(handler, 405)
+                return
+            content_encoding = handler.headers.get('X-Upload-Content-Encoding', 'identity')
+            if not self.accepts(handler, content_encoding):
+                return
+            session_id = str(len(self.sessions))
+            self.sessions[session_id] = {'data': b'', 'content_encoding': content_encoding}
+            headers = self.accept_encoding_headers()
+            headers['Location'] = '/uploads/' + session_id
+            self.respond(handler, 201, headers=headers)
+            return
+
+        if method == 'PUT' and handler.path.startswith('/uploads/'):
+            self.handle_chunk(handler, self.sessions.get(handler.path.split('/')[-1]), body)
+            return
+
+        if method == 'PATCH' and handler.path == '/scene.json':
+            if not self.accept_patches:
+                self.respond(handler, 405)
+                return
+            apply_patch(self.scene, json.loads(body.decode('utf-8')))
+            self.respond(handler, 200)
+            return
+
+        self.respond(handler, 404)
+
+    def accepts(self, handler, content_encoding):
+        if content_encoding == 'identity' or content_encoding in self.content_encodings:
+            return True
+        self.rejected_requests.append(self.requests.pop())
+        self.respond(handler, 415, headers={
+            'Accept-Encoding': ', '.join(self.content_encodings) or 'identity'
+        })
+        return False
+
+    def accept_encoding_headers(self):
+        if len(self.content_encodings) == 0:
+            return {}
+        return {'Accept-Encoding': ', '.join(self.content_encodings)}
+
+    def store_scene(self, body, content_encoding):
+        if content_encoding != 'identity':
+            body = decompress(body, content_encoding)
+        self.scene = json.loads(body.decode('utf-8'))
+
+    def handle_chunk(self, handler, session, body):
+        if session is None:
+            self.respond(handler, 404)
+            return
+
+        fault = self.faults.pop(0) if len(self.faults) > 0 else None
+        if fault == 'error':
+            self.respond(handler, 503)
+            return
+
+        # Content-Range: bytes first-last/size or bytes */size
+        chunk_range, size = handler.headers['Content-Range'].split(' ')[1].split('/')
+        data = session['data']
+        if chunk_range != '*':
+            first = int(chunk_range.split('-')[0])
+            if first <= len(data):
+                data = data + body[len(data) - first:]
+        session['data'] = data
+
+        if fault == 'disconnect':
+            handler.close_connection = True
+            return
+
+        if size != '*' and len(data) == int(size):
+            self.store_scene(data, session['content_encoding'])
+            self.respond(handler, 200)
+            return
+
+        headers = {}
+        if len(data) > 0:
+            headers['Range'] = 'bytes=0-{}'.format(len(data) - 1)
+        self.respond(handler, 308, headers=headers)
+
+    @staticmethod
+    def respond(handler, code, data=None, headers={}):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        handler.send_response(code)
+        handler.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def requests_bytes(self, method):
+        return sum(len(body) for m, path, headers, body in self.requests if m == method)
+
+
+def decompress(body, content_encoding):
+    if content_encoding == 'gzip':
+        return gzip.decompress(body)
+    return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+
+
+def read_chunked(rfile):
+    body = b''
+    while True:
+        line = rfile.readline()
+        if len(line) == 0:
+            return None
+        size = int(line.split(b';')[0], 16)
+        if size == 0:
+            # Skip the trailers
+            while rfile.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            return body
+        body += rfile.read(size)
+        rfile.readline()
+
+
+def apply_patch(document, patch):
+    def apply(items, changes):
+        removed = set(changes['removed'])
+        new = dict((item['uuid'], item) for item in changes['set'])
+        ret = [new.pop(item['uuid'], item) for item in items if item['uuid'] not in removed]
+        return ret + [item for item in changes['set'] if item['uuid'] in new]
+
+    document['geometries'] = apply(document['geometries'], patch['geometries'])
+
+    root = document['object']
+    children = apply(root['children'], patch['objects'])
+    if 'object' in patch:
+        document['metadata'] = patch['metadata']
+        root = dict(patch['object'])
+    root['children'] = children
+    document['object'] = root
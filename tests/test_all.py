@@ -1,8 +1,26 @@
+import asyncio
+import base64
+import itertools
+import json
+import threading
+import types
 import unittest
 import bpy
 import mathutils
+import numpy
 from io_scene_previz import *
 from io_scene_previz.three_js_exporter import *
+from io_scene_previz.geometry_data import (
+    FACE_TYPE_QUAD,
+    PRECISION_QUANTIZE,
+    PRECISION_ROUND,
+    Precision,
+    build_faces,
+    polygon_faces,
+    reduce_precision,
+    weld_uvs
+)
+from .server import *
 from .tasks import *
 from .utils import *
 
@@ -189,28 +207,367 @@ class TestOperators(unittest.TestCase):
         self.assertTrue(filepath.exists())
 
 
+def load_export(path):
+    with path.open() as fp:
+        s = json.load(fp)
+    uuid = itertools.count()
+    for g in s['geometries']:
+        g['uuid'] = next(uuid)
+    s['object']['uuid'] = next(uuid)
+    for o in s['object']['children']:
+        o['geometry'] = next(uuid)
+        o['uuid'] = next(uuid)
+    return s
+
+
+class TestTasksRunner(unittest.TestCase):
+    def test_queued_tasks(self):
+        class HeavyTask(TestTask):
+            priority = PRIORITY_BACKGROUND
+            concurrency_group = 'heavy'
+
+        class InteractiveTask(TestTask):
+            priority = PRIORITY_INTERACTIVE
+
+        def tick_until(condition):
+            while not condition():
+                time.sleep(.05)
+                runner.tick(bpy.context)
+
+        runner = TasksRunner(max_running=2, concurrency={'heavy': 1})
+
+        heavy_tasks = [HeavyTask(timeout=10) for i in range(3)]
+        for task in heavy_tasks:
+            runner.add_task(bpy.context, task)
+        self.assertEqual([t.status for t in heavy_tasks], [RUNNING, QUEUED, QUEUED])
+        self.assertEqual(heavy_tasks[1].state, 'Queued')
+
+        interactive_tasks = [InteractiveTask(timeout=10) for i in range(2)]
+        for task in interactive_tasks:
+            runner.add_task(bpy.context, task)
+        self.assertEqual([t.status for t in interactive_tasks], [RUNNING, QUEUED])
+
+        runner.cancel_task(heavy_tasks[2])
+        self.assertEqual(heavy_tasks[2].status, CANCELED)
+
+        # The freed slot goes to the interactive task
+        runner.cancel_task(heavy_tasks[0])
+        tick_until(lambda: heavy_tasks[0].status == CANCELED)
+        self.assertEqual(interactive_tasks[1].status, RUNNING)
+        self.assertEqual(heavy_tasks[1].status, QUEUED)
+
+        runner.cancel()
+        tick_until(lambda: runner.is_finished)
+        self.assertEqual(heavy_tasks[1].status, CANCELED)
+
+    def test_poll_interval(self):
+        runner = TasksRunner(min_poll_interval=.01, max_poll_interval=.04)
+        self.assertIsNone(runner.poll(bpy.context))
+
+        task = TestTask(timeout=.2)
+        runner.add_task(bpy.context, task)
+        self.assertEqual([runner.poll(bpy.context) for i in range(4)], [.01, .01, .01, .01])
+
+        # The worker thread wakes the runner up when it is done
+        self.assertTrue(runner.results_posted.wait(5))
+        self.assertEqual(runner.poll(bpy.context), .01)
+        self.assertEqual(task.status, DONE)
+
+        # Backing off once the change of the finished task is notified
+        self.assertEqual([runner.poll(bpy.context) for i in range(4)], [.01, .02, .04, .04])
+
+    def test_result_latency(self):
+        runner = TasksRunner(min_poll_interval=.01, max_poll_interval=.25)
+        task = TestTask(timeout=1)
+
+        posted = []
+        post = runner.post
+        def timed_post(task, msg):
+            posted.append(time.time())
+            post(task, msg)
+        runner.post = timed_post
+        runner.add_task(bpy.context, task)
+
+        # As the timer polls, while the task runs without results
+        while True:
+            interval = runner.poll(bpy.context)
+            if task.status == DONE:
+                break
+            time.sleep(interval)
+
+        self.assertLess(time.time() - posted[-1], .1)
+
+    def test_results_batches(self):
+        runner = TasksRunner(max_results_batch=2)
+        task = TestTask(timeout=10)
+        runner.add_task(bpy.context, task)
+
+        updates = []
+        task.update = lambda context, request, data: updates.append(data)
+        for i in range(5):
+            task.queue_to_main.put((TASK_UPDATE, ('test', i)))
+
+        runner.tick(bpy.context)
+        self.assertEqual(updates, [0, 1])
+        self.assertTrue(runner.results_posted.is_set())
+        runner.tick(bpy.context)
+        runner.tick(bpy.context)
+        self.assertEqual(updates, [0, 1, 2, 3, 4])
+
+        runner.cancel()
+        while not runner.is_finished:
+            time.sleep(.05)
+            runner.tick(bpy.context)
+        self.assertEqual(task.status, CANCELED)
+
+    def test_coalesced_changes(self):
+        runner = TasksRunner(max_change_notify_rate=10)
+        changes = []
+        runner.on_task_changed.append(lambda runner, task: changes.append(time.time()))
+
+        tasks = [TestTask(timeout=.05) for i in range(3)]
+        for task in tasks:
+            runner.add_task(bpy.context, task)
+        self.assertEqual(changes, [])
+        runner.tick(bpy.context)
+        self.assertEqual(len(changes), 1)
+
+        while not runner.is_finished or runner.has_changes:
+            time.sleep(.01)
+            runner.poll(bpy.context)
+        self.assertGreater(len(changes), 1)
+        for previous, change in zip(changes, changes[1:]):
+            self.assertGreaterEqual(change - previous, .099)
+
+
 class TestThreeJSExporter(unittest.TestCase):
     @scene('test_exporter.blend')
     @mkdtemp
     def test_export(self, tmpdir, scenepath):
-        def load(path):
-            with path.open() as fp:
-                s = json.load(fp)
-            uuid = itertools.count()
-            for g in s['geometries']:
-                g['uuid'] = next(uuid)
-            s['object']['uuid'] = next(uuid)
-            for o in s['object']['children']:
-                o['geometry'] = next(uuid)
-                o['uuid'] = next(uuid)
-            return s
+        export_path = tmpdir / 'test_export.json'
+        with export_path.open('w') as fp:
+            export(build_scene(bpy.context), fp)
+
+        self.assertEqual(load_export(export_path),
+                         load_export(scenepath.with_suffix('.json')))
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_export_geometry_pool(self, tmpdir, scenepath):
+        export_path = tmpdir / 'test_export.json'
+        with GeometryPool(2) as pool, export_path.open('w') as fp:
+            export(build_scene(bpy.context, Geometries(pool=pool)), fp)
+
+        self.assertEqual(load_export(export_path),
+                         load_export(scenepath.with_suffix('.json')))
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_build_document(self, tmpdir, scenepath):
+        export_path = tmpdir / 'test_export.json'
+        with GeometryPool(2) as pool, export_path.open('w') as fp:
+            json.dump(build_document(build_scene(bpy.context, Geometries(pool=pool))), fp)
+
+        self.assertEqual(load_export(export_path),
+                         load_export(scenepath.with_suffix('.json')))
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_export_weld_uvs(self, tmpdir, scenepath):
+        def corner_uvs(geometry):
+            data = geometry['data']
+            faces = iter(data['faces'])
+            ret = []
+            for face_type in faces:
+                corners_count = 4 if face_type & FACE_TYPE_QUAD else 3
+                vertex_indices = [next(faces) for i in range(corners_count)]
+                for uvs in data['uvs']:
+                    for i in range(corners_count):
+                        uv_index = next(faces)
+                        ret.append(uvs[uv_index*2:uv_index*2+2])
+            return ret
 
         export_path = tmpdir / 'test_export.json'
         with export_path.open('w') as fp:
-            previz.export(build_scene(bpy.context), fp)
+            export(build_scene(bpy.context, Geometries(weld_uvs=True)), fp)
+
+        with export_path.open() as fp:
+            welded = json.load(fp)
+        with scenepath.with_suffix('.json').open() as fp:
+            expected = json.load(fp)
 
-        self.assertEqual(load(export_path),
-                         load(scenepath.with_suffix('.json')))
+        for geometry, expected_geometry in zip(welded['geometries'], expected['geometries']):
+            self.assertEqual(geometry['data']['vertices'],
+                             expected_geometry['data']['vertices'])
+            self.assertEqual(corner_uvs(geometry), corner_uvs(expected_geometry))
+            for uvs, expected_uvs in zip(geometry['data']['uvs'], expected_geometry['data']['uvs']):
+                self.assertLess(len(uvs), len(expected_uvs))
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_export_share_identical_geometries(self, tmpdir, scenepath):
+        export_path = tmpdir / 'test_export.json'
+        with export_path.open('w') as fp:
+            export(build_scene(bpy.context, Geometries(share_identical=True)), fp)
+
+        s = load_three_js_json(export_path)
+        self.assertEqual(len(s['geometries']), 1)
+        self.assertEqual(len(s['object']['children']), 2)
+        geometry_uuid = s['geometries'][0]['uuid']
+        for o in s['object']['children']:
+            self.assertEqual(o['geometry'], geometry_uuid)
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_export_buffer_geometry(self, tmpdir, scenepath):
+        def read_buffer(buffer, dtype):
+            uri = buffer['uri']
+            if uri.startswith('data:'):
+                data = base64.b64decode(uri.split(',', 1)[1])
+            else:
+                with (tmpdir / uri).open('rb') as fp:
+                    fp.seek(buffer['byteOffset'])
+                    data = fp.read(buffer['byteLength'])
+            return numpy.frombuffer(data, dtype=dtype)
+
+        for geometry_format in ('BUFFER_BIN', 'BUFFER_BASE64'):
+            filepath = tmpdir / 'export.json'
+            bpy.ops.export_scene.previz_export_scene(
+                filepath=str(filepath),
+                geometry_format=geometry_format
+            )
+            s = load_three_js_json(filepath)
+
+            self.assertEqual(len(s['geometries']), 2)
+            for g in s['geometries']:
+                self.assertEqual(g['type'], 'BufferGeometry')
+                attributes = g['data']['attributes']
+                self.assertListEqual(sorted(attributes.keys()), ['position', 'uv', 'uv2'])
+
+                position = read_buffer(attributes['position']['buffer'], '<f4')
+                uv = read_buffer(attributes['uv']['buffer'], '<f4')
+                index = read_buffer(g['data']['index']['buffer'], '<u4')
+                self.assertEqual(len(position) // 3, len(uv) // 2)
+                # Golden file faces: 4 triangles and 1 quad
+                self.assertEqual(len(index), 3 * 6)
+                self.assertLess(index.max(), len(position) // 3)
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_change_tracker(self, tmpdir, scenepath):
+        def export_scene(tracker=None):
+            export_path = tmpdir / 'test_export.json'
+            with export_path.open('w') as fp:
+                if tracker is None:
+                    export(build_scene(bpy.context), fp)
+                else:
+                    geometries = tracker.begin()
+                    export(build_scene(bpy.context, geometries, tracker), fp)
+                    tracker.exported(geometries)
+            return load_three_js_json(export_path, strip_uuids=True)
+
+        tracker = io_scene_previz.change_tracker
+        tracker.clear()
+        export_scene(tracker)
+
+        bpy.data.objects['NgonObjectNoHierarchy'].location.x += 1
+        bpy.context.view_layer.update()
+        self.assertEqual(len(tracker.dirty_transforms), 1)
+
+        self.assertEqual(export_scene(tracker), export_scene())
+        self.assertEqual(len(tracker.dirty_transforms), 0)
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_change_tracker_frame_change(self, tmpdir, scenepath):
+        def export_scene(tracker=None):
+            export_path = tmpdir / 'test_export.json'
+            with export_path.open('w') as fp:
+                if tracker is None:
+                    export(build_scene(bpy.context), fp)
+                else:
+                    geometries = tracker.begin()
+                    export(build_scene(bpy.context, geometries, tracker), fp)
+                    tracker.exported(geometries)
+            return load_three_js_json(export_path, strip_uuids=True)
+
+        blender_object = bpy.data.objects['NgonObjectNoHierarchy']
+        blender_object.keyframe_insert('location', frame=1)
+        blender_object.location.x += 1
+        blender_object.keyframe_insert('location', frame=2)
+
+        tracker = io_scene_previz.change_tracker
+        bpy.context.scene.frame_set(1)
+        tracker.clear()
+        export_scene(tracker)
+
+        bpy.context.scene.frame_set(2)
+        self.assertEqual(len(tracker.dirty_transforms), len(tracker.matrices))
+
+        self.assertEqual(export_scene(tracker), export_scene())
+
+    @scene('test_exporter.blend')
+    def test_change_tracker_update_during_export(self, scenepath):
+        tracker = io_scene_previz.change_tracker
+        tracker.clear()
+
+        geometries = tracker.begin()
+        scene = snapshot_scene(bpy.context, geometries, tracker)
+        bpy.data.objects['NgonObjectNoHierarchy'].location.x += 1
+        bpy.context.view_layer.update()
+        tracker.exported(geometries)
+
+        self.assertEqual(len(tracker.dirty_transforms), 1)
+
+    def test_build_faces(self):
+        # A quad, a triangle, a pentagon and a triangle
+        loop_starts = numpy.array([0, 4, 7, 12], dtype=numpy.int32)
+        loop_totals = numpy.array([4, 3, 5, 3], dtype=numpy.int32)
+        ngon_triangle_loops = numpy.array([[7, 8, 9], [7, 9, 10], [7, 10, 11]], dtype=numpy.int32)
+        ngon_triangle_polygons = numpy.array([2, 2, 2], dtype=numpy.int32)
+
+        corner_loops, face_sizes = polygon_faces(
+            loop_starts,
+            loop_totals,
+            ngon_triangle_loops,
+            ngon_triangle_polygons
+        )
+
+        self.assertListEqual(
+            corner_loops.tolist(),
+            [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 7, 9, 10, 7, 10, 11, 12, 13, 14]
+        )
+        self.assertListEqual(face_sizes.tolist(), [4, 3, 3, 3, 3, 3])
+        self.assertListEqual(
+            build_faces(corner_loops[:7], face_sizes[:2], [numpy.arange(7)]*2).tolist(),
+            [9, 0, 1, 2, 3, 0, 1, 2, 3, 0, 1, 2, 3,
+             8, 4, 5, 6, 4, 5, 6, 4, 5, 6]
+        )
+        self.assertListEqual(
+            build_faces(corner_loops[:7], face_sizes[:2], []).tolist(),
+            [1, 0, 1, 2, 3, 0, 4, 5, 6]
+        )
+
+    def test_weld_uvs(self):
+        uvs = numpy.array([[.5, .5], [0, 0], [.5, .5], [1, 0], [0, 0]], dtype=numpy.float32)
+        distinct, indices = weld_uvs(uvs)
+        self.assertListEqual(distinct.tolist(), [[.5, .5], [0, 0], [1, 0]])
+        self.assertListEqual(indices.tolist(), [0, 1, 0, 2, 1])
+
+    def test_reduce_precision(self):
+        values = numpy.array([[0.6013696193695068, 0.809686005115509],
+                              [0.5115320086479187, 0.6894978284835815],
+                              [0.1, 0.6894978284835815]], dtype=numpy.float32)
+
+        self.assertListEqual(
+            reduce_precision(values, Precision(PRECISION_ROUND, 4)).tolist(),
+            [[0.6014, 0.8097], [0.5115, 0.6895], [0.1, 0.6895]]
+        )
+        self.assertListEqual(
+            reduce_precision(values, Precision(PRECISION_QUANTIZE, 8)).tolist(),
+            [[0.6014, 0.8097], [0.5109, 0.6895], [0.1, 0.6895]]
+        )
+        self.assertIs(reduce_precision(values, None), values)
 
     def test_color2threejs(self):
         def c(r, g, b):
@@ -220,6 +577,438 @@ class TestThreeJSExporter(unittest.TestCase):
         self.assertEqual(c(.13, 2.47, .21), 2228022)
 
 
+class TestPublishSceneTask(unittest.TestCase):
+    def setUp(self):
+        self.retry_delay = io_scene_previz.upload.RETRY_DELAY
+        io_scene_previz.upload.RETRY_DELAY = 0
+
+    def tearDown(self):
+        io_scene_previz.upload.RETRY_DELAY = self.retry_delay
+
+    def publish(self, server, export_path, queue_to_worker=None, uploads=None, resume=False):
+        if queue_to_worker is None:
+            queue_to_worker = queue.Queue()
+        geometries = Geometries(pool=DeferredPool())
+        scene = snapshot_scene(bpy.context, geometries) if not resume else None
+        queue_to_main = queue.Queue()
+        PublishSceneTask.thread_run(
+            queue_to_worker,
+            queue_to_main,
+            server.api_root,
+            'api_token',
+            'project_id',
+            'scene_id',
+            export_path,
+            scene=scene,
+            geometries=geometries,
+            uploads=uploads,
+            resume=resume
+        )
+        messages = []
+        while not queue_to_main.empty():
+            messages.append(queue_to_main.get()[0])
+        return messages
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_pipelined_publish(self, tmpdir, scenepath):
+        export_path = tmpdir / 'test_export.json'
+        with StandInServer() as server:
+            messages = self.publish(server, export_path)
+
+        self.assertEqual(messages[-1], TASK_DONE)
+        self.assertIn(TASK_UPDATE, messages)
+        self.assertEqual(load_export(export_path),
+                         load_export(scenepath.with_suffix('.json')))
+
+        # Uploaded while exported, and the same as the debug copy
+        method, path, headers, body = server.requests[-1]
+        self.assertEqual(method, 'PUT')
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertEqual(server.scene, load_three_js_json(export_path))
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_compressed_publish(self, tmpdir, scenepath):
+        export_path = tmpdir / 'test_export.json'
+        with StandInServer() as server:
+            # Uncompressed until the server advertises its encodings
+            self.publish(server, None)
+            method, path, headers, body = server.requests[-1]
+            self.assertNotIn('Content-Encoding', headers)
+
+            del server.requests[:]
+            self.publish(server, export_path)
+
+        method, path, headers, body = server.requests[-1]
+        self.assertIn(headers['Content-Encoding'], ('gzip', 'zstd'))
+        self.assertLess(server.requests_bytes('PUT'), export_path.stat().st_size / 2)
+        self.assertEqual(server.scene, load_three_js_json(export_path))
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_compressed_publish_fallback(self, tmpdir, scenepath):
+        export_path = tmpdir / 'test_export.json'
+        with StandInServer(content_encodings=()) as server:
+            response = types.SimpleNamespace(headers={'Accept-Encoding': 'gzip'})
+            io_scene_previz.upload.content_encodings.advertised(server.scene_json_url, response)
+            messages = self.publish(server, None)
+
+            self.assertEqual(messages[-1], TASK_DONE)
+            self.assertEqual(len(server.rejected_requests), 1)
+            method, path, headers, body = server.requests[-1]
+            self.assertNotIn('Content-Encoding', headers)
+
+            # The server encodings are known for the next publish
+            self.publish(server, export_path)
+            self.assertEqual(len(server.rejected_requests), 1)
+            self.assertEqual(server.scene, load_three_js_json(export_path))
+
+    @scene('test_exporter.blend')
+    def test_accepted_encoding_rejected(self, scenepath):
+        with StandInServer(content_encodings=()) as server:
+            io_scene_previz.upload.content_encodings.accepted(server.scene_json_url, 'gzip')
+            messages = self.publish(server, None)
+
+            self.assertEqual(messages[-1], TASK_DONE)
+            self.assertEqual(len(server.rejected_requests), 1)
+            self.assertIsNotNone(server.scene)
+
+    @scene('test_exporter.blend')
+    def test_cancel_pipelined_publish(self, scenepath):
+        queue_to_worker = queue.Queue()
+        queue_to_worker.put((REQUEST_CANCEL, None))
+        with StandInServer() as server:
+            messages = self.publish(server, None, queue_to_worker)
+
+            self.assertEqual(messages[-1], RESPOND_CANCELED)
+            self.assertIsNone(server.scene)
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_resumable_publish(self, tmpdir, scenepath):
+        export_path = tmpdir / 'test_export.json'
+        uploads = io_scene_previz.upload.UploadStore(tmpdir / 'uploads')
+        with StandInServer(faults=['error', 'disconnect']) as server:
+            messages = self.publish(server, export_path, uploads=uploads)
+
+            self.assertEqual(messages[-1], TASK_DONE)
+            self.assertEqual(server.scene, load_three_js_json(export_path))
+            self.assertEqual(list((tmpdir / 'uploads').iterdir()), [])
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_resume_interrupted_publish(self, tmpdir, scenepath):
+        export_path = tmpdir / 'test_export.json'
+        uploads = io_scene_previz.upload.UploadStore(tmpdir / 'uploads')
+        faults = ['error'] * (io_scene_previz.upload.RETRIES + 1)
+        with StandInServer(faults=faults) as server:
+            messages = self.publish(server, export_path, uploads=uploads)
+
+            self.assertEqual(messages[-1], TASK_ERROR)
+            self.assertIsNone(server.scene)
+            self.assertTrue(uploads.can_resume(server.api_root, 'scene_id'))
+
+            # As after a restart, with a new store
+            uploads = io_scene_previz.upload.UploadStore(tmpdir / 'uploads')
+            messages = self.publish(server, None, uploads=uploads, resume=True)
+
+            self.assertEqual(messages[-1], TASK_DONE)
+            self.assertEqual(server.scene, load_three_js_json(export_path))
+            self.assertFalse(uploads.can_resume(server.api_root, 'scene_id'))
+
+    @mkdtemp
+    def test_resumable_upload_faults(self, tmpdir):
+        document = {'values': [str(i) for i in range(100000)]}
+        uploads = io_scene_previz.upload.UploadStore(tmpdir / 'uploads')
+        faults = [None, 'error', None, 'disconnect', None, 'error']
+        with StandInServer(faults=faults) as server:
+            p = PrevizProject(server.api_root, 'api_token')
+            resumable = io_scene_previz.upload.ResumableUpload.start(
+                p,
+                uploads,
+                server.api_root,
+                'scene_id',
+                server.scene_json_url,
+                chunk_size=16 * 1024,
+                retry_delay=0
+            )
+            fp = resumable.spool.text_writer()
+            json.dump(document, fp)
+            fp.flush()
+            resumable.spool.close()
+            resumable.send()
+
+            self.assertEqual(server.scene, document)
+            # The chunk kept by the server before disconnecting is not sent again
+            self.assertLess(server.requests_bytes('PUT'), resumable.spool.written + 3 * 16 * 1024)
+
+    def test_pipe(self):
+        pipe = io_scene_previz.upload.Pipe(max_size=4)
+        fp = pipe.text_writer()
+
+        def write():
+            fp.write('0123456789')
+            fp.flush()
+            pipe.close()
+        thread = threading.Thread(target=write)
+        thread.start()
+
+        self.assertEqual(pipe.read(3), b'012')
+        self.assertEqual(pipe.read(), b'3456789')
+        self.assertEqual(pipe.read(), b'')
+        thread.join()
+
+        pipe = io_scene_previz.upload.Pipe()
+        pipe.close(RuntimeError('Export failed'))
+        self.assertRaises(RuntimeError, pipe.read)
+
+    @scene('test_exporter.blend')
+    def test_snapshot_scene_task(self, scenepath):
+        scenes = []
+        geometries = Geometries(pool=DeferredPool())
+        task = SnapshotSceneTask(geometries,
+                                 on_done=lambda context, scene: scenes.append(scene),
+                                 slice_duration=0)
+        io_scene_previz.tasks_runner.add_task(bpy.context, task)
+        wait_for_queue_to_finish()
+
+        self.assertEqual(task.status, DONE)
+        self.assertEqual([mesh.name for mesh in scenes[0].objects],
+                         [o.name for o in exportable_objects(bpy.context)])
+
+
+class TestGeometryCache(unittest.TestCase):
+    @mkdtemp
+    def test_geometry_cache(self, tmpdir):
+        c = io_scene_previz.cache.GeometryCache(tmpdir / 'cache', 1024)
+        self.assertIsNone(c.get('a'))
+
+        c.put('a', [8, 0, 1, 2], [0., 1., 2.], [['UVMap', [0., 1.]]], 1.)
+        self.assertEqual(c.get('a'), ([8, 0, 1, 2], [0., 1., 2.], [['UVMap', [0., 1.]]]))
+        self.assertEqual((c.hits, c.misses), (1, 1))
+
+        c = io_scene_previz.cache.GeometryCache(tmpdir / 'cache', 0)
+        self.assertIsNotNone(c.get('a'))
+        c.trim()
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(list((tmpdir / 'cache').iterdir()), [])
+
+    @mkdtemp
+    def test_tree_cache(self, tmpdir):
+        c = io_scene_previz.cache.TreeCache(tmpdir / 'trees', 'api_root', 'api_token')
+        self.assertEqual(c.teams(), (None, None))
+        self.assertEqual(c.updated_plugin(), (False, None))
+
+        teams = [{'id': 't', 'title': 'Team', 'projects': []}]
+        teams_hash = c.put_teams(teams)
+        c.put_updated_plugin({'version': '2.0.0'})
+
+        c = io_scene_previz.cache.TreeCache(tmpdir / 'trees', 'api_root', 'api_token')
+        self.assertEqual(c.teams(), (teams, teams_hash))
+        self.assertEqual(c.updated_plugin(), (True, {'version': '2.0.0'}))
+        self.assertEqual(c.put_teams(teams), teams_hash)
+
+        c = io_scene_previz.cache.TreeCache(tmpdir / 'trees', 'api_root', 'api_token', plugin_check_ttl=0)
+        self.assertEqual(c.updated_plugin(), (False, {'version': '2.0.0'}))
+
+        c = io_scene_previz.cache.TreeCache(tmpdir / 'trees', 'api_root', 'other_token')
+        self.assertEqual(c.teams(), (None, None))
+
+
+class TestDeltaPublish(unittest.TestCase):
+    def publish(self, server, export_path, manifests, delta_publish=True):
+        queue_to_main = queue.Queue()
+        PublishSceneTask.thread_run(
+            queue.Queue(),
+            queue_to_main,
+            server.api_root,
+            'api_token',
+            'project_id',
+            'scene_id',
+            export_path,
+            manifests,
+            delta_publish
+        )
+        # The upload progress comes first
+        messages = []
+        while not queue_to_main.empty():
+            messages.append(queue_to_main.get()[0])
+        self.assertEqual(messages[-1], TASK_DONE)
+
+    def publish_twice(self, server, tmpdir):
+        manifests = delta.ManifestStore(tmpdir / 'manifests')
+        export_path = tmpdir / 'export.json'
+
+        bpy.ops.export_scene.previz_export_scene(filepath=str(export_path))
+        self.publish(server, export_path, manifests)
+        full_upload_size = server.requests_bytes('PUT')
+
+        bpy.data.objects['NgonObjectNoHierarchy'].location.x += 1
+        bpy.ops.export_scene.previz_export_scene(filepath=str(export_path))
+        self.publish(server, export_path, manifests)
+
+        document = load_three_js_json(export_path)
+        delta.normalize(document)
+        self.assertEqual(server.scene, document)
+
+        return full_upload_size
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_delta_publish(self, tmpdir, scenepath):
+        with StandInServer(content_encodings=()) as server:
+            full_upload_size = self.publish_twice(server, tmpdir)
+
+            self.assertEqual(server.requests_bytes('PUT'), full_upload_size)
+            self.assertLess(server.requests_bytes('PATCH'), full_upload_size / 2)
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_delta_publish_fallback(self, tmpdir, scenepath):
+        with StandInServer(accept_patches=False, content_encodings=()) as server:
+            full_upload_size = self.publish_twice(server, tmpdir)
+
+            self.assertEqual(server.requests_bytes('PUT'), 2 * full_upload_size)
+
+    @scene('test_exporter.blend')
+    @mkdtemp
+    def test_full_publish_removes_manifest(self, tmpdir, scenepath):
+        manifests = delta.ManifestStore(tmpdir / 'manifests')
+        export_path = tmpdir / 'export.json'
+        bpy.ops.export_scene.previz_export_scene(filepath=str(export_path))
+        exported = export_path.read_text()
+
+        with StandInServer(content_encodings=()) as server:
+            self.publish(server, export_path, manifests)
+            self.assertIsNotNone(manifests.load(server.api_root, 'scene_id'))
+            # The caller's file is not replaced by the normalized scene
+            self.assertEqual(export_path.read_text(), exported)
+
+            self.publish(server, export_path, manifests, delta_publish=False)
+            self.assertIsNone(manifests.load(server.api_root, 'scene_id'))
+
+
+class TestClient(unittest.TestCase):
+    def test_shared_session(self):
+        clients = io_scene_previz.client.ClientManager()
+        with StandInServer(content_encodings=()) as server:
+            for i in range(3):
+                p = clients.project(server.api_root, 'api_token', 'project_id')
+                p.request('PUT', server.scene_json_url, data=json.dumps({'i': i})).raise_for_status()
+        clients.close()
+
+        self.assertEqual(server.scene, {'i': 2})
+        self.assertEqual(clients.stats.requests, 3)
+        self.assertEqual(clients.stats.connections, 1)
+        self.assertIsNotNone(clients.new_report())
+        self.assertIsNone(clients.new_report())
+        for method, path, headers, body in server.requests:
+            self.assertEqual(headers['X-PREVIZ-PLUGIN-NAME'], 'io_scene_blender')
+            self.assertEqual(headers['X-PREVIZ-PLUGIN-VERSION'], io_scene_previz.version_string)
+            self.assertEqual(headers['Authorization'], 'Bearer api_token')
+
+    def test_conditional_requests(self):
+        clients = io_scene_previz.client.ClientManager()
+        with StandInServer() as server:
+            server.teams = [{'id': 't', 'title': 'Team', 'projects': []}]
+            p = clients.project(server.api_root, 'api_token')
+
+            teams = p.get_all()
+            self.assertEqual(p.get_all(), teams)
+            server.teams[0]['title'] = 'Renamed'
+            self.assertEqual(p.get_all()[0]['title'], 'Renamed')
+
+            session, conditional = clients.session(server.api_root, 'api_token')
+            self.assertEqual(conditional.revalidated, 1)
+        clients.close()
+
+        validators = [headers.get('If-None-Match') for method, path, headers, body in server.requests]
+        self.assertIsNone(validators[0])
+        self.assertIsNotNone(validators[1])
+        self.assertEqual(validators[2], validators[1])
+
+    def test_loop_thread(self):
+        loop_thread = io_scene_previz.client.LoopThread()
+        barrier = threading.Barrier(2, timeout=5)
+
+        async def wait_together():
+            # Both calls have to run at once to pass the barrier
+            loop = asyncio.get_running_loop()
+            return await asyncio.gather(loop.run_in_executor(None, barrier.wait),
+                                        loop.run_in_executor(None, barrier.wait))
+
+        future = loop_thread.submit(wait_together())
+        self.assertEqual(sorted(future.result(timeout=5)), [0, 1])
+
+        pending = loop_thread.submit(asyncio.sleep(60))
+        loop_thread.stop()
+        self.assertTrue(pending.cancelled())
+        self.assertIsNone(loop_thread.loop)
+
+
+class Scene(dict):
+    """Stand-in for the bpy Scene previz_active_* properties"""
+    __getattr__ = dict.get
+    __setattr__ = dict.__setitem__
+
+
+class TestActive(unittest.TestCase):
+    def test_indexes(self):
+        utils = io_scene_previz.utils
+        context = types.SimpleNamespace(scene=Scene(previz_active_team_id='t',
+                                                    previz_active_project_id='p1'))
+
+        def teams(title):
+            projects = [{'id': 'p0', 'title': 'P0', 'scenes': []},
+                        {'id': 'p1', 'title': title, 'scenes': []}]
+            return utils.extract_all([{'id': 't', 'title': 'T', 'projects': projects}])
+
+        active = utils.Active()
+        active.teams = teams('P1')
+        self.assertEqual(active.project(context)['title'], 'P1')
+
+        menu_items = active.project_menu_items()(None, context)
+        self.assertEqual([item[:2] for item in menu_items], [('p0', 'P0'), ('p1', 'P1')])
+        self.assertIs(active.project_menu_items()(None, context), menu_items)
+
+        active.teams = teams('Renamed')
+        self.assertEqual(active.project(context)['title'], 'Renamed')
+        self.assertEqual(active.project_menu_items()(None, context)[1][1], 'Renamed')
+
+    def test_lazy_tree(self):
+        utils = io_scene_previz.utils
+        context = types.SimpleNamespace(scene=Scene())
+        loads = []
+
+        active = utils.Active(lazy_cache_size=2)
+        active.load_children = lambda context, item, name: loads.append((name, item['id']))
+        active.update_teams(utils.extract_teams([{'id': 't0', 'title': 'T0'},
+                                                 {'id': 't1', 'title': 'T1'}]), 'hash')
+
+        context.scene.previz_active_team_id = 't0'
+        active.ensure_loaded(context)
+        self.assertEqual(loads, [('projects', 't0')])
+
+        team = {'projects': [{'id': 'p0', 'title': 'P0', 'scenes': []}]}
+        active.set_children(context, 'projects', 't0', utils.extract_projects(team))
+        self.assertEqual(active.project(context)['id'], 'p0')
+        self.assertEqual(loads[-1], ('scenes', 'p0'))
+
+        project = {'scenes': [{'id': 's0', 'title': 'S0'}]}
+        active.set_children(context, 'scenes', 'p0', utils.extract_scenes(project))
+        self.assertEqual(active.scene(context)['id'], 's0')
+
+        # Loading a third list unloads the least recently used one
+        context.scene.previz_active_team_id = 't1'
+        active.ensure_loaded(context)
+        self.assertEqual(loads[-1], ('projects', 't1'))
+        active.set_children(context, 'projects', 't1', [])
+        self.assertIsNone(active.teams[0]['projects'])
+        self.assertIsNone(active.project(context))
+        self.assertEqual(len(loads), 3)
+
+
 class TestHorizonColor(unittest.TestCase):
     def setUp(self):
         class Object(object):
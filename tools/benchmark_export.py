@@ -0,0 +1,245 @@
+"""
+Export benchmark
+
+Run from Blender, with the add-on enabled, on the scene to measure:
+
+    blender --background scene.blend --python tools/benchmark_export.py -- --mode stream
+
+Prints the export time, the output size and the peak memory (POSIX only).
+The peak resident set size of a process never decreases, so compare modes
+with one Blender run per mode.
+
+--round DECIMALS or --quantize BITS reduce the precision of the vertices
+and UVs, to compare sizes and times with the full precision export:
+
+    for blend in tests/blends/*.blend; do
+        for precision in "" "--round 4" "--quantize 16"; do
+            blender --background $blend --python tools/benchmark_export.py -- $precision
+        done
+    done
+
+--workers N... builds the JSON geometries with pools of N worker
+processes, and prints the export time for each N. Each pool is warmed up
+with an untimed export, as starting the processes takes a while:
+
+    blender --background scene.blend --python tools/benchmark_export.py -- --workers 1 2 4 8 16 32
+
+--baseline-rev REV loads three_js_exporter from the git revision REV of
+this repository, to measure the exporter as it was there with the baseline
+mode. Other modes are then compared with the baseline export time and
+size, and with --workers, the baseline export time is printed first and
+each pool is compared with it too:
+
+    blender --background scene.blend --python tools/benchmark_export.py -- --mode baseline --baseline-rev v1.2.1
+
+Modes:
+    stream    three_js_exporter.export, writing geometries as they are built
+    document  builds the whole three.js document in memory, then json.dump
+    baseline  previz.export(build_scene(context)) with the exporter of
+              --baseline-rev
+"""
+import argparse
+import json
+import os
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import bpy
+import previz
+
+from io_scene_previz import three_js_exporter
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss /= 1024
+    return maxrss / 1024
+
+
+def export_stream(scene, fp):
+    three_js_exporter.export(scene, fp)
+
+
+def export_document(scene, fp):
+    objects = []
+    geometries = []
+    geometry_uuids = {}
+    for mesh in list(scene.objects):
+        if mesh.geometry_key not in geometry_uuids:
+            if mesh.encoded_geometry is not None:
+                geometry = json.loads(mesh.encoded_geometry.json)
+            else:
+                geometry = three_js_exporter.build_geometry(scene, mesh)
+            geometry_uuids[mesh.geometry_key] = geometry['uuid']
+            geometries.append(geometry)
+        objects.append(previz.build_object(mesh, geometry_uuids[mesh.geometry_key]))
+
+    document = {
+        'animations': [],
+        'geometries': geometries,
+        'images': [],
+        'materials': [],
+        'metadata': previz.build_metadata(scene),
+        'object': previz.build_scene_root(scene, objects),
+        'textures': []
+    }
+    json.dump(document, fp, indent=1, sort_keys=True)
+
+
+def export_baseline(scene, fp):
+    previz.export(scene, fp)
+
+
+MODES = {
+    'stream': export_stream,
+    'document': export_document,
+    'baseline': export_baseline
+}
+
+
+def load_baseline_exporter(rev):
+    """
+    three_js_exporter module of the add-on at the git revision rev.
+    """
+    repository = pathlib.Path(__file__).resolve().parent.parent
+    path = 'io_scene_previz/three_js_exporter.py'
+    source = subprocess.check_output(['git', 'show', '{}:{}'.format(rev, path)],
+                                     cwd=str(repository))
+    module = types.ModuleType('io_scene_previz.baseline_three_js_exporter')
+    module.__package__ = 'io_scene_previz'
+    exec(compile(source, '{}:{}'.format(rev, path), 'exec'), module.__dict__)
+    return module
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description='Benchmark the Previz exporter')
+    parser.add_argument('--mode', choices=sorted(MODES.keys()), default='stream')
+    parser.add_argument('--output', help='Export path, a temporary file by default')
+    precision = parser.add_mutually_exclusive_group()
+    precision.add_argument('--round', type=int, metavar='DECIMALS')
+    precision.add_argument('--quantize', type=int, metavar='BITS')
+    parser.add_argument('--workers', type=int, nargs='+', metavar='N')
+    parser.add_argument('--baseline-rev', metavar='REV')
+    args = parser.parse_args(argv)
+    if args.baseline_rev is None and args.mode == 'baseline':
+        parser.error('the baseline mode needs --baseline-rev')
+    if args.mode == 'baseline' and (args.workers is not None
+                                    or args.round is not None
+                                    or args.quantize is not None):
+        parser.error('the baseline mode has no precision or workers')
+    return args
+
+
+def precision(args):
+    if args.round is not None:
+        return three_js_exporter.Precision(three_js_exporter.PRECISION_ROUND, args.round)
+    if args.quantize is not None:
+        return three_js_exporter.Precision(three_js_exporter.PRECISION_QUANTIZE, args.quantize)
+    return None
+
+
+def export(args, output, pool=None):
+    if args.mode == 'baseline':
+        with open(output, 'w') as fp:
+            export_baseline(args.baseline_exporter.build_scene(bpy.context), fp)
+        return
+
+    geometries = three_js_exporter.Geometries(precision=precision(args), pool=pool)
+    with open(output, 'w') as fp:
+        MODES[args.mode](three_js_exporter.build_scene(bpy.context, geometries), fp)
+
+
+def baseline_time(args, output):
+    baseline_args = argparse.Namespace(**dict(vars(args), mode='baseline'))
+    t0 = time.time()
+    export(baseline_args, output)
+    return time.time() - t0
+
+
+def benchmark(args, output):
+    rss_before = peak_rss_mb()
+    t0 = time.time()
+    export(args, output)
+    dt = time.time() - t0
+    rss_after = peak_rss_mb()
+
+    size = os.path.getsize(output)
+
+    print('Scene        : {}'.format(bpy.data.filepath))
+    print('Mode         : {}'.format(args.mode))
+    if args.baseline_rev is not None:
+        print('Baseline rev : {}'.format(args.baseline_rev))
+    print('Precision    : {}'.format(precision(args)))
+    print('Time         : {:.3f}s'.format(dt))
+    print('Size         : {:.3f}MB'.format(size / 1024 / 1024))
+    print('Peak RSS     : {:.1f}MB'.format(rss_after))
+    print('Peak RSS gain: {:.1f}MB'.format(rss_after - rss_before))
+
+    # Once the peak RSS of the mode is read
+    if args.baseline_rev is not None and args.mode != 'baseline':
+        baseline = baseline_time(args, output)
+        baseline_size = os.path.getsize(output)
+        print('Baseline     : {:.3f}s, {:.3f}MB'.format(baseline, baseline_size / 1024 / 1024))
+        print('Gain         : {:.2f}x faster, {:.0%} of the size'.format(baseline / dt, size / baseline_size))
+
+
+def benchmark_workers(args, output):
+    print('Scene        : {}'.format(bpy.data.filepath))
+    print('Mode         : {}'.format(args.mode))
+    print('Precision    : {}'.format(precision(args)))
+
+    baseline = None
+    if args.baseline_rev is not None:
+        baseline = baseline_time(args, output)
+        print('Baseline     : {:.3f}s ({})'.format(baseline, args.baseline_rev))
+
+    times = {}
+    for workers in args.workers:
+        pool = three_js_exporter.GeometryPool(workers) if workers > 1 else None
+        try:
+            export(args, output, pool)
+            t0 = time.time()
+            export(args, output, pool)
+            times[workers] = time.time() - t0
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        line = '{:3d} workers  : {:.3f}s, {:.2f}x'.format(
+            workers,
+            times[workers],
+            times[args.workers[0]] / times[workers]
+        )
+        if baseline is not None:
+            line += ', {:.2f}x baseline'.format(baseline / times[workers])
+        print(line)
+
+
+def main():
+    args = parse_args()
+    if args.baseline_rev is not None:
+        args.baseline_exporter = load_baseline_exporter(args.baseline_rev)
+
+    output = args.output
+    if output is None:
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+
+    if args.workers is None:
+        benchmark(args, output)
+    else:
+        benchmark_workers(args, output)
+
+    if args.output is None:
+        os.remove(output)
+
+
+main()